@@ -16,13 +16,15 @@ JD_BRAND_COLORS = {
     "gris": "#7a7a7a",
 }
 
-from datetime import date, datetime
+from datetime import date
 from fpdf import FPDF
 from gastos_automaticos import obtener_gastos_totales_con_automaticos
 from ai_analysis import get_ai_summary
 import database
 
 from database import (
+    GASTOS_RESUMEN_COLS,
+    VENTAS_RESUMEN_COLS,
     delete_gasto,
     delete_venta,
     get_gasto_by_id,
@@ -33,8 +35,13 @@ from database import (
     inferir_campo_taller_existentes,
     insert_gasto,
     insert_venta,
+    list_recent_gasto_ids,
+    list_recent_gastos,
+    list_recent_venta_ids,
+    list_recent_ventas,
     update_gasto,
     update_venta,
+    vacuum_db,
 )
 
 st.set_page_config(
@@ -201,14 +208,14 @@ def _render_env_debug():
 
     # Contadores rápidos (vía pandas)
     try:
-        df_v = get_ventas()
+        df_v = get_ventas(columns=VENTAS_RESUMEN_COLS)
         st.sidebar.caption(f"Ventas: {len(df_v)}")
         if len(df_v):
             st.sidebar.caption(f"Rango ventas: {df_v['fecha'].min()} -> {df_v['fecha'].max()}")
     except Exception:
         st.sidebar.caption("Ventas: error al leer")
     try:
-        df_g = get_gastos()
+        df_g = get_gastos(columns=GASTOS_RESUMEN_COLS)
         st.sidebar.caption(f"Gastos: {len(df_g)}")
         if len(df_g):
             st.sidebar.caption(f"Rango gastos: {df_g['fecha'].min()} -> {df_g['fecha'].max()}")
@@ -218,45 +225,34 @@ def _render_env_debug():
     # Conteos crudos directo a DB para aislar problemas
     if database.USE_POSTGRES:
         try:
-            conn = database.get_connection()
-            cur = conn.cursor()
+            with database.get_connection() as conn:
+                cur = conn.cursor()
 
-            cur.execute("SELECT COUNT(*) AS c FROM ventas")
-            row = cur.fetchone()
-            ventas_raw = row["c"] if isinstance(row, dict) else row[0]
+                cur.execute("SELECT COUNT(*) AS c FROM ventas")
+                row = cur.fetchone()
+                ventas_raw = row["c"] if isinstance(row, dict) else row[0]
 
-            cur.execute("SELECT COUNT(*) AS c FROM gastos")
-            row = cur.fetchone()
-            gastos_raw = row["c"] if isinstance(row, dict) else row[0]
+                cur.execute("SELECT COUNT(*) AS c FROM gastos")
+                row = cur.fetchone()
+                gastos_raw = row["c"] if isinstance(row, dict) else row[0]
 
-            cur.execute("SELECT MIN(fecha) AS minf, MAX(fecha) AS maxf FROM ventas")
-            row = cur.fetchone()
-            fecha_min = row["minf"] if isinstance(row, dict) else row[0]
-            fecha_max = row["maxf"] if isinstance(row, dict) else row[1]
+                cur.execute("SELECT MIN(fecha) AS minf, MAX(fecha) AS maxf FROM ventas")
+                row = cur.fetchone()
+                fecha_min = row["minf"] if isinstance(row, dict) else row[0]
+                fecha_max = row["maxf"] if isinstance(row, dict) else row[1]
 
-            st.sidebar.caption(
-                f"[DB] ventas={ventas_raw} gastos={gastos_raw} "
-                f"rango ventas: {fecha_min} -> {fecha_max}"
-            )
+                st.sidebar.caption(
+                    f"[DB] ventas={ventas_raw} gastos={gastos_raw} "
+                    f"rango ventas: {fecha_min} -> {fecha_max}"
+                )
         except Exception as exc:
             st.sidebar.caption(f"[DB] Error conteos: {type(exc).__name__}: {exc}")
-        finally:
-            try:
-                if cur:
-                    cur.close()
-            except Exception:
-                pass
-            try:
-                if conn:
-                    conn.close()
-            except Exception:
-                pass
 
 _render_env_debug()
 
 def get_summary(period_label: str = "Período completo") -> dict:
-    df_ventas = get_ventas()
-    df_gastos = get_gastos()
+    df_ventas = get_ventas(columns=VENTAS_RESUMEN_COLS)
+    df_gastos = get_gastos(columns=GASTOS_RESUMEN_COLS)
 
     total_ingresos = df_ventas["total"].sum() if len(df_ventas) else 0.0
     total_gastos = (df_gastos["total_pct_se"].fillna(0) + df_gastos["total_pct_re"].fillna(0)).sum() if len(df_gastos) else 0.0
@@ -2620,155 +2616,18 @@ def render_dashboard():
         "Esta es una versión base. Usa esta sección para diseñar los KPIs que realmente necesites."
     )
 
-def render_sales_page():
-    st.title("💰 Ventas")
-    st.subheader("Registrar nueva venta")
-
-    sucursales_default = ["COMODORO", "RIO GRANDE", "RIO GALLEGOS", "COMPARTIDOS"]
-    tipos_trabajo = ["EXTERNO", "INTERNO"]
-
-    # Selector de tipo fuera del form para que se actualice dinámicamente
-    if "tipo_re_se_selector" not in st.session_state:
-        st.session_state.tipo_re_se_selector = "RE"
-    
-    tipo_re_se_selector = st.selectbox(
-        "Tipo de venta (RE o SE)", 
-        ["RE", "SE"], 
-        index=0 if st.session_state.tipo_re_se_selector == "RE" else 1,
-        key="tipo_re_se_selector"
-    )
-    # No asignar manualmente, el key ya lo maneja automáticamente
-    
-    with st.form("form_crear_venta"):
-        col_a, col_b = st.columns(2)
-        with col_a:
-            fecha = st.date_input("Fecha", value=date.today())
-            sucursal = st.selectbox("Sucursal", sucursales_default)
-            cliente = st.text_input("Cliente / Cuenta")
-            tipo_comprobante = st.selectbox(
-                "Tipo Comprobante",
-                ["FACTURA VENTA", "NOTA CREDITO", "NOTA DE CREDITO JD", "OTRO"],
-            )
-            trabajo = st.selectbox("Trabajo", tipos_trabajo)
-        with col_b:
-            pin = ""
-            if tipo_re_se_selector == "SE":
-                pin = st.text_input("PIN / Identificador", value="")
-            n_comprobante = st.text_input("N° de comprobante")
-            
-            campo_taller = None
-            if tipo_re_se_selector == "SE":
-                campo_taller = st.selectbox(
-                    "Campo / Taller", 
-                    ["Campo", "Taller"], 
-                    key="campo_taller_form"
-                )
-            detalles = st.text_area("Detalles", height=90)
-
-        st.markdown("**Componentes económicos (USD)**")
-        
-        # Inicializar valores por defecto
-        mano_obra = 0.0
-        asistencia = 0.0
-        terceros = 0.0
-        
-        if tipo_re_se_selector == "SE":
-            # Para SE: mostrar todos los campos
-            col_m1, col_m2, col_m3 = st.columns(3)
-            with col_m1:
-                mano_obra = st.number_input("Mano de obra", min_value=0.0, value=0.0, step=0.01)
-                asistencia = st.number_input("Asistencia", min_value=0.0, value=0.0, step=0.01)
-            with col_m2:
-                repuestos = st.number_input("Repuestos", min_value=0.0, value=0.0, step=0.01)
-                terceros = st.number_input("Terceros", min_value=0.0, value=0.0, step=0.01)
-            with col_m3:
-                descuento = st.number_input("Descuento", min_value=0.0, value=0.0, step=0.01)
-            
-            total_calculado = mano_obra + asistencia + repuestos + terceros - descuento
-            st.metric(
-                "💰 Total calculado",
-                format_currency(total_calculado),
-                delta=(
-                    f"MO {format_currency(mano_obra)} + Asist {format_currency(asistencia)} + "
-                    f"Rep {format_currency(repuestos)} + Terc {format_currency(terceros)} - Desc {format_currency(descuento)}"
-                ),
-            )
-        else:
-            # Para RE: solo mostrar Repuestos y Descuento
-            col_m1, col_m2 = st.columns(2)
-            with col_m1:
-                repuestos = st.number_input("Repuestos", min_value=0.0, value=0.0, step=0.01)
-            with col_m2:
-                descuento = st.number_input("Descuento", min_value=0.0, value=0.0, step=0.01)
-            
-            total_calculado = repuestos - descuento
-            st.metric(
-                "💰 Total calculado",
-                format_currency(total_calculado),
-                delta=(
-                    f"Rep {format_currency(repuestos)} - Desc {format_currency(descuento)}"
-                ),
-            )
-        st.caption("El total se calcula automáticamente y se vuelve negativo si la nota de crédito lo requiere.")
-
-        submit = st.form_submit_button("💾 Guardar venta")
-        if submit:
-            total = total_calculado
-            es_nota_credito = (
-                tipo_comprobante
-                and "NOTA" in tipo_comprobante.upper()
-                and "CREDITO" in tipo_comprobante.upper()
-                and "JD" not in tipo_comprobante.upper()
-            )
-            if es_nota_credito and total > 0:
-                total = -total
-
-            if total == 0:
-                st.error("El total calculado no puede ser 0.")
-            else:
-                venta_data = {
-                    "mes": fecha.strftime("%B"),
-                    "fecha": fecha,
-                    "sucursal": sucursal,
-                    "cliente": cliente or None,
-                    "pin": pin or None,
-                    "comprobante": tipo_comprobante,
-                    "tipo_comprobante": tipo_comprobante,
-                    "trabajo": trabajo,
-                    "n_comprobante": n_comprobante or None,
-                    "tipo_re_se": tipo_re_se_selector,
-                    "mano_obra": mano_obra,
-                    "asistencia": asistencia,
-                    "repuestos": repuestos,
-                    "terceros": terceros,
-                    "descuento": descuento,
-                    "total": total,
-                    "detalles": detalles or None,
-                    "archivo_comprobante": None,
-                    "campo_taller": campo_taller if tipo_re_se_selector == "SE" else None,
-                }
-                try:
-                    insert_venta(venta_data)
-                    st.success("✅ Venta registrada correctamente.")
-                    st.rerun()
-                except Exception as exc:
-                    st.error(f"❌ Error al guardar: {exc}")
-
-    st.divider()
-    st.subheader("Ventas registradas")
-    df_ventas = get_ventas()
-    if len(df_ventas) == 0:
-        st.info("Aún no hay ventas cargadas.")
-        return
-
-    st.dataframe(
-        df_ventas.sort_values("fecha", ascending=False).head(50),
-        use_container_width=True,
-    )
-
-    st.subheader("Editar o eliminar")
-    opciones = ["(ninguna)"] + [str(v) for v in df_ventas.sort_values("fecha", ascending=False)["id"].tolist()]
-    selected = st.selectbox("Selecciona una venta", opciones)
+@st.fragment
+def _edit_venta_fragment(sucursales_default, tipos_trabajo):
+    """Selector y formulario de edición de ventas; cambiar la selección solo re-ejecuta este fragmento."""
+    # El desplegable lista solo las ventas más recientes; las anteriores se buscan por ID
+    col_sel, col_id = st.columns([3, 1])
+    with col_sel:
+        opciones = ["(ninguna)"] + [str(v) for v in list_recent_venta_ids()]
+        selected = st.selectbox("Selecciona una venta", opciones)
+    with col_id:
+        id_manual = st.number_input("o ingresa su ID", min_value=0, value=0, step=1, key="venta_id_manual")
+    if id_manual:
+        selected = str(id_manual)
     if selected == "(ninguna)":
         return
 
@@ -2777,7 +2636,11 @@ def render_sales_page():
         st.warning("No se encontró el registro.")
         return
 
-    fecha_reg = datetime.strptime(str(registro["fecha"]), "%Y-%m-%d").date()
+    fecha_reg = (
+        date.fromisoformat(registro["fecha"])
+        if isinstance(registro["fecha"], str)
+        else registro["fecha"]
+    )
 
     with st.form("form_editar_venta"):
         col_a, col_b = st.columns(2)
@@ -2913,80 +2776,164 @@ def render_sales_page():
         except Exception as exc:
             st.error(f"❌ Error al eliminar: {exc}")
 
-def render_expenses_page():
-    st.title("💸 Gastos")
-    st.subheader("Registrar gasto")
+def render_sales_page():
+    st.title("💰 Ventas")
+    st.subheader("Registrar nueva venta")
 
     sucursales_default = ["COMODORO", "RIO GRANDE", "RIO GALLEGOS", "COMPARTIDOS"]
-    areas_default = ["POSTVENTA", "SERVICIO", "REPUESTOS"]
+    tipos_trabajo = ["EXTERNO", "INTERNO"]
 
-    with st.form("form_crear_gasto"):
+    # Selector de tipo fuera del form para que se actualice dinámicamente
+    if "tipo_re_se_selector" not in st.session_state:
+        st.session_state.tipo_re_se_selector = "RE"
+    
+    tipo_re_se_selector = st.selectbox(
+        "Tipo de venta (RE o SE)", 
+        ["RE", "SE"], 
+        index=0 if st.session_state.tipo_re_se_selector == "RE" else 1,
+        key="tipo_re_se_selector"
+    )
+    # No asignar manualmente, el key ya lo maneja automáticamente
+    
+    with st.form("form_crear_venta"):
         col_a, col_b = st.columns(2)
         with col_a:
-            fecha = st.date_input("Fecha", value=date.today(), key="gasto_fecha")
-            sucursal = st.selectbox("Sucursal", sucursales_default, key="gasto_sucursal")
-            area = st.selectbox("Área", areas_default, key="gasto_area")
-            tipo = st.selectbox("Tipo", ["FIJO", "VARIABLE"], key="gasto_tipo")
-            clasificacion = st.text_input("Clasificación", key="gasto_clasificacion")
+            fecha = st.date_input("Fecha", value=date.today())
+            sucursal = st.selectbox("Sucursal", sucursales_default)
+            cliente = st.text_input("Cliente / Cuenta")
+            tipo_comprobante = st.selectbox(
+                "Tipo Comprobante",
+                ["FACTURA VENTA", "NOTA CREDITO", "NOTA DE CREDITO JD", "OTRO"],
+            )
+            trabajo = st.selectbox("Trabajo", tipos_trabajo)
         with col_b:
-            proveedor = st.text_input("Proveedor (opcional)", key="gasto_proveedor")
-            pct_postventa = st.slider("% Postventa", 0.0, 1.0, 1.0, 0.05, key="gasto_pct_postventa")
-            pct_servicios = st.slider("% Servicios", 0.0, 1.0, 1.0, 0.05, key="gasto_pct_servicios")
-            pct_repuestos = st.slider("% Repuestos", 0.0, 1.0, 0.0, 0.05, key="gasto_pct_repuestos")
+            pin = ""
+            if tipo_re_se_selector == "SE":
+                pin = st.text_input("PIN / Identificador", value="")
+            n_comprobante = st.text_input("N° de comprobante")
+            
+            campo_taller = None
+            if tipo_re_se_selector == "SE":
+                campo_taller = st.selectbox(
+                    "Campo / Taller", 
+                    ["Campo", "Taller"], 
+                    key="campo_taller_form"
+                )
+            detalles = st.text_area("Detalles", height=90)
 
-        total_usd = st.number_input(
-            "Total USD", min_value=-1_000_000.0, value=0.0, step=0.01, key="gasto_total_usd"
-        )
-        detalles = st.text_area("Detalles", key="gasto_detalles")
+        st.markdown("**Componentes económicos (USD)**")
+        
+        # Inicializar valores por defecto
+        mano_obra = 0.0
+        asistencia = 0.0
+        terceros = 0.0
+        
+        if tipo_re_se_selector == "SE":
+            # Para SE: mostrar todos los campos
+            col_m1, col_m2, col_m3 = st.columns(3)
+            with col_m1:
+                mano_obra = st.number_input("Mano de obra", min_value=0.0, value=0.0, step=0.01)
+                asistencia = st.number_input("Asistencia", min_value=0.0, value=0.0, step=0.01)
+            with col_m2:
+                repuestos = st.number_input("Repuestos", min_value=0.0, value=0.0, step=0.01)
+                terceros = st.number_input("Terceros", min_value=0.0, value=0.0, step=0.01)
+            with col_m3:
+                descuento = st.number_input("Descuento", min_value=0.0, value=0.0, step=0.01)
+            
+            total_calculado = mano_obra + asistencia + repuestos + terceros - descuento
+            st.metric(
+                "💰 Total calculado",
+                format_currency(total_calculado),
+                delta=(
+                    f"MO {format_currency(mano_obra)} + Asist {format_currency(asistencia)} + "
+                    f"Rep {format_currency(repuestos)} + Terc {format_currency(terceros)} - Desc {format_currency(descuento)}"
+                ),
+            )
+        else:
+            # Para RE: solo mostrar Repuestos y Descuento
+            col_m1, col_m2 = st.columns(2)
+            with col_m1:
+                repuestos = st.number_input("Repuestos", min_value=0.0, value=0.0, step=0.01)
+            with col_m2:
+                descuento = st.number_input("Descuento", min_value=0.0, value=0.0, step=0.01)
+            
+            total_calculado = repuestos - descuento
+            st.metric(
+                "💰 Total calculado",
+                format_currency(total_calculado),
+                delta=(
+                    f"Rep {format_currency(repuestos)} - Desc {format_currency(descuento)}"
+                ),
+            )
+        st.caption("El total se calcula automáticamente y se vuelve negativo si la nota de crédito lo requiere.")
 
-        submit = st.form_submit_button("💾 Guardar gasto")
+        submit = st.form_submit_button("💾 Guardar venta")
         if submit:
-            if not clasificacion:
-                st.error("Completa la clasificación.")
-            elif total_usd == 0:
-                st.error("El total no puede ser 0.")
+            total = total_calculado
+            es_nota_credito = (
+                tipo_comprobante
+                and "NOTA" in tipo_comprobante.upper()
+                and "CREDITO" in tipo_comprobante.upper()
+                and "JD" not in tipo_comprobante.upper()
+            )
+            if es_nota_credito and total > 0:
+                total = -total
+
+            if total == 0:
+                st.error("El total calculado no puede ser 0.")
             else:
-                total_pct = total_usd * pct_postventa
-                gasto_data = {
+                venta_data = {
                     "mes": fecha.strftime("%B"),
                     "fecha": fecha,
                     "sucursal": sucursal,
-                    "area": area,
-                    "pct_postventa": pct_postventa,
-                    "pct_servicios": pct_servicios,
-                    "pct_repuestos": pct_repuestos,
-                    "tipo": tipo,
-                    "clasificacion": clasificacion,
-                    "proveedor": proveedor or None,
-                    "total_pesos": None,
-                    "total_usd": total_usd,
-                    "total_pct": total_pct,
-                    "total_pct_se": total_pct * pct_servicios,
-                    "total_pct_re": total_pct * pct_repuestos,
+                    "cliente": cliente or None,
+                    "pin": pin or None,
+                    "comprobante": tipo_comprobante,
+                    "tipo_comprobante": tipo_comprobante,
+                    "trabajo": trabajo,
+                    "n_comprobante": n_comprobante or None,
+                    "tipo_re_se": tipo_re_se_selector,
+                    "mano_obra": mano_obra,
+                    "asistencia": asistencia,
+                    "repuestos": repuestos,
+                    "terceros": terceros,
+                    "descuento": descuento,
+                    "total": total,
                     "detalles": detalles or None,
+                    "archivo_comprobante": None,
+                    "campo_taller": campo_taller if tipo_re_se_selector == "SE" else None,
                 }
                 try:
-                    insert_gasto(gasto_data)
-                    st.success("✅ Gasto registrado.")
+                    insert_venta(venta_data)
+                    st.success("✅ Venta registrada correctamente.")
                     st.rerun()
                 except Exception as exc:
                     st.error(f"❌ Error al guardar: {exc}")
-            
-            st.divider()
-    st.subheader("Gastos registrados")
-    df_gastos = get_gastos()
-    if len(df_gastos) == 0:
-        st.info("Aún no hay gastos cargados.")
+
+    st.divider()
+    st.subheader("Ventas registradas")
+    df_ventas = list_recent_ventas(50)
+    if len(df_ventas) == 0:
+        st.info("Aún no hay ventas cargadas.")
         return
 
-    st.dataframe(
-        df_gastos.sort_values("fecha", ascending=False).head(50),
-        use_container_width=True,
-    )
+    st.dataframe(df_ventas, use_container_width=True)
 
     st.subheader("Editar o eliminar")
-    opciones = ["(ninguno)"] + [str(g) for g in df_gastos.sort_values("fecha", ascending=False)["id"].tolist()]
-    selected = st.selectbox("Selecciona un gasto", opciones)
+    _edit_venta_fragment(sucursales_default, tipos_trabajo)
+
+@st.fragment
+def _edit_gasto_fragment(sucursales_default, areas_default):
+    """Selector y formulario de edición de gastos; cambiar la selección solo re-ejecuta este fragmento."""
+    # El desplegable lista solo los gastos más recientes; los anteriores se buscan por ID
+    col_sel, col_id = st.columns([3, 1])
+    with col_sel:
+        opciones = ["(ninguno)"] + [str(g) for g in list_recent_gasto_ids()]
+        selected = st.selectbox("Selecciona un gasto", opciones)
+    with col_id:
+        id_manual = st.number_input("o ingresa su ID", min_value=0, value=0, step=1, key="gasto_id_manual")
+    if id_manual:
+        selected = str(id_manual)
     if selected == "(ninguno)":
         return
 
@@ -2995,7 +2942,11 @@ def render_expenses_page():
         st.warning("No se encontró el gasto.")
         return
 
-    fecha_reg = datetime.strptime(str(registro["fecha"]), "%Y-%m-%d").date()
+    fecha_reg = (
+        date.fromisoformat(registro["fecha"])
+        if isinstance(registro["fecha"], str)
+        else registro["fecha"]
+    )
 
     with st.form("form_editar_gasto"):
         col_a, col_b = st.columns(2)
@@ -3104,6 +3055,77 @@ def render_expenses_page():
         except Exception as exc:
             st.error(f"❌ Error al eliminar: {exc}")
 
+def render_expenses_page():
+    st.title("💸 Gastos")
+    st.subheader("Registrar gasto")
+
+    sucursales_default = ["COMODORO", "RIO GRANDE", "RIO GALLEGOS", "COMPARTIDOS"]
+    areas_default = ["POSTVENTA", "SERVICIO", "REPUESTOS"]
+
+    with st.form("form_crear_gasto"):
+        col_a, col_b = st.columns(2)
+        with col_a:
+            fecha = st.date_input("Fecha", value=date.today(), key="gasto_fecha")
+            sucursal = st.selectbox("Sucursal", sucursales_default, key="gasto_sucursal")
+            area = st.selectbox("Área", areas_default, key="gasto_area")
+            tipo = st.selectbox("Tipo", ["FIJO", "VARIABLE"], key="gasto_tipo")
+            clasificacion = st.text_input("Clasificación", key="gasto_clasificacion")
+        with col_b:
+            proveedor = st.text_input("Proveedor (opcional)", key="gasto_proveedor")
+            pct_postventa = st.slider("% Postventa", 0.0, 1.0, 1.0, 0.05, key="gasto_pct_postventa")
+            pct_servicios = st.slider("% Servicios", 0.0, 1.0, 1.0, 0.05, key="gasto_pct_servicios")
+            pct_repuestos = st.slider("% Repuestos", 0.0, 1.0, 0.0, 0.05, key="gasto_pct_repuestos")
+
+        total_usd = st.number_input(
+            "Total USD", min_value=-1_000_000.0, value=0.0, step=0.01, key="gasto_total_usd"
+        )
+        detalles = st.text_area("Detalles", key="gasto_detalles")
+
+        submit = st.form_submit_button("💾 Guardar gasto")
+        if submit:
+            if not clasificacion:
+                st.error("Completa la clasificación.")
+            elif total_usd == 0:
+                st.error("El total no puede ser 0.")
+            else:
+                total_pct = total_usd * pct_postventa
+                gasto_data = {
+                    "mes": fecha.strftime("%B"),
+                    "fecha": fecha,
+                    "sucursal": sucursal,
+                    "area": area,
+                    "pct_postventa": pct_postventa,
+                    "pct_servicios": pct_servicios,
+                    "pct_repuestos": pct_repuestos,
+                    "tipo": tipo,
+                    "clasificacion": clasificacion,
+                    "proveedor": proveedor or None,
+                    "total_pesos": None,
+                    "total_usd": total_usd,
+                    "total_pct": total_pct,
+                    "total_pct_se": total_pct * pct_servicios,
+                    "total_pct_re": total_pct * pct_repuestos,
+                    "detalles": detalles or None,
+                }
+                try:
+                    insert_gasto(gasto_data)
+                    st.success("✅ Gasto registrado.")
+                    st.rerun()
+                except Exception as exc:
+                    st.error(f"❌ Error al guardar: {exc}")
+            
+            st.divider()
+    st.subheader("Gastos registrados")
+    df_gastos = list_recent_gastos(50)
+    if len(df_gastos) == 0:
+        st.info("Aún no hay gastos cargados.")
+        return
+
+    st.dataframe(df_gastos, use_container_width=True)
+
+    st.subheader("Editar o eliminar")
+    _edit_gasto_fragment(sucursales_default, areas_default)
+
     st.title("📈 Reportes")
     tab_gastos, tab_ventas = st.tabs(["💸 Gastos", "💰 Ventas"])
 
@@ -3132,6 +3154,16 @@ def render_settings_page():
     st.write("- Acá podés agregar toggles, credenciales o cualquier ajuste global.")
     st.write("- Es buen lugar para exponer backup / restore si lo necesitás en la nueva versión.")
 
+    st.subheader("Mantenimiento de la base de datos")
+    st.caption("Compacta el archivo y actualiza las estadísticas de consulta. Conviene hacerlo después de borrar muchos registros.")
+    if st.button("🧹 Compactar base de datos"):
+        try:
+            with st.spinner("Compactando..."):
+                vacuum_db()
+            st.success("✅ Base de datos compactada.")
+        except Exception as exc:
+            st.error(f"❌ Error al compactar: {exc}")
+
 if NAVIGATION[current_page] == "overview":
     render_dashboard()
 elif NAVIGATION[current_page] == "sales":
@@ -5,18 +5,16 @@ import pandas as pd
 from database import get_ventas
 from gastos_automaticos import obtener_gastos_totales_con_automaticos
 
-def calcular_factor_absorcion_servicios(
-    fecha_inicio: str = None,
-    fecha_fin: str = None,
-    por_sucursal: bool = False
-) -> dict:
-    """
-    Calcula el factor de absorción de servicios
-    
-    Factor de absorción = Ingresos Servicios / Gastos Fijos * 100
-    Margen $ = Ingresos - Gastos Variables
-    Resultado Operativo = Margen - Gastos Fijos
-    """
+# Configuración de cada factor de absorción:
+# (clave de ingresos, filtro tipo_re_se o None para todos, columnas de gasto)
+_MODOS_ABSORCION = {
+    'servicios': ('ingresos_servicios', 'SE', ['total_pct_se']),
+    'repuestos': ('ingresos_repuestos', 'RE', ['total_pct_re']),
+    'postventa': ('ingresos_totales', None, ['total_pct_se', 'total_pct_re']),
+}
+
+def _obtener_ventas_y_gastos(fecha_inicio: str = None, fecha_fin: str = None):
+    """Obtiene ventas y gastos (registrados + automáticos) una sola vez"""
     df_ventas = get_ventas(fecha_inicio, fecha_fin)
     gastos_totales = obtener_gastos_totales_con_automaticos(fecha_inicio, fecha_fin)
     
@@ -24,50 +22,79 @@ def calcular_factor_absorcion_servicios(
     if len(gastos_totales['gastos_automaticos']) > 0:
         df_gastos = pd.concat([df_gastos, gastos_totales['gastos_automaticos']], ignore_index=True)
     
-    gastos_fijos = df_gastos[df_gastos['tipo'] == 'FIJO']['total_pct_se'].sum() if len(df_gastos) > 0 else 0
-    gastos_variables = df_gastos[df_gastos['tipo'] == 'VARIABLE']['total_pct_se'].sum() if len(df_gastos) > 0 else 0
+    return df_ventas, df_gastos
+
+def _kpis_absorcion(clave_ingresos: str, ingresos, gastos_fijos, gastos_variables) -> dict:
+    factor_absorcion = (ingresos / gastos_fijos * 100) if gastos_fijos > 0 else 0
+    margen = ingresos - gastos_variables
+    resultado_operativo = margen - gastos_fijos
+    
+    return {
+        clave_ingresos: ingresos,
+        'gastos_fijos': gastos_fijos,
+        'gastos_variables': gastos_variables,
+        'factor_absorcion': factor_absorcion,
+        'margen': margen,
+        'resultado_operativo': resultado_operativo
+    }
+
+def _calcular_factor(
+    modo: str,
+    df_ventas: pd.DataFrame,
+    df_gastos: pd.DataFrame,
+    por_sucursal: bool = False
+) -> dict:
+    """
+    Calcula un factor de absorción ('servicios', 'repuestos' o 'postventa')
+    sobre ventas y gastos ya obtenidos
+    """
+    clave_ingresos, tipo_re_se, columnas_gasto = _MODOS_ABSORCION[modo]
+    
+    df_ingresos = df_ventas
+    if tipo_re_se is not None:
+        df_ingresos = df_ventas[df_ventas['tipo_re_se'] == tipo_re_se]
+    
+    gasto_fila = df_gastos[columnas_gasto].sum(axis=1)
+    es_fijo = df_gastos['tipo'] == 'FIJO'
+    es_variable = df_gastos['tipo'] == 'VARIABLE'
     
     if por_sucursal:
-        resultados = {}
-        sucursales = df_ventas['sucursal'].dropna().unique()
+        # Un solo groupby por concepto en lugar de filtrar por cada sucursal
+        ingresos_suc = df_ingresos.groupby('sucursal')['total'].sum()
+        fijos_suc = gasto_fila[es_fijo].groupby(df_gastos['sucursal'][es_fijo]).sum()
+        variables_suc = gasto_fila[es_variable].groupby(df_gastos['sucursal'][es_variable]).sum()
         
-        for sucursal in sucursales:
-            df_ventas_suc = df_ventas[df_ventas['sucursal'] == sucursal]
-            ingresos_servicios = df_ventas_suc[df_ventas_suc['tipo_re_se'] == 'SE']['total'].sum()
-            
-            df_gastos_suc = df_gastos[df_gastos['sucursal'] == sucursal]
-            gastos_fijos_suc = df_gastos_suc[df_gastos_suc['tipo'] == 'FIJO']['total_pct_se'].sum()
-            gastos_variables_suc = df_gastos_suc[df_gastos_suc['tipo'] == 'VARIABLE']['total_pct_se'].sum()
-            
-            factor_absorcion = (ingresos_servicios / gastos_fijos_suc * 100) if gastos_fijos_suc > 0 else 0
-            margen = ingresos_servicios - gastos_variables_suc
-            resultado_operativo = margen - gastos_fijos_suc
-            
-            resultados[sucursal] = {
-                'ingresos_servicios': ingresos_servicios,
-                'gastos_fijos': gastos_fijos_suc,
-                'gastos_variables': gastos_variables_suc,
-                'factor_absorcion': factor_absorcion,
-                'margen': margen,
-                'resultado_operativo': resultado_operativo
-            }
+        resultados = {}
+        for sucursal in df_ventas['sucursal'].dropna().unique():
+            resultados[sucursal] = _kpis_absorcion(
+                clave_ingresos,
+                ingresos_suc.get(sucursal, 0),
+                fijos_suc.get(sucursal, 0),
+                variables_suc.get(sucursal, 0),
+            )
         
         return resultados
-    else:
-        ingresos_servicios = df_ventas[df_ventas['tipo_re_se'] == 'SE']['total'].sum() if len(df_ventas) > 0 else 0
-        
-        factor_absorcion = (ingresos_servicios / gastos_fijos * 100) if gastos_fijos > 0 else 0
-        margen = ingresos_servicios - gastos_variables
-        resultado_operativo = margen - gastos_fijos
-        
-        return {
-            'ingresos_servicios': ingresos_servicios,
-            'gastos_fijos': gastos_fijos,
-            'gastos_variables': gastos_variables,
-            'factor_absorcion': factor_absorcion,
-            'margen': margen,
-            'resultado_operativo': resultado_operativo
-        }
+    
+    ingresos = df_ingresos['total'].sum()
+    gastos_fijos = gasto_fila[es_fijo].sum()
+    gastos_variables = gasto_fila[es_variable].sum()
+    
+    return _kpis_absorcion(clave_ingresos, ingresos, gastos_fijos, gastos_variables)
+
+def calcular_factor_absorcion_servicios(
+    fecha_inicio: str = None,
+    fecha_fin: str = None,
+    por_sucursal: bool = False
+) -> dict:
+    """
+    Calcula el factor de absorción de servicios
+    
+    Factor de absorción = Ingresos Servicios / Gastos Fijos * 100
+    Margen $ = Ingresos - Gastos Variables
+    Resultado Operativo = Margen - Gastos Fijos
+    """
+    df_ventas, df_gastos = _obtener_ventas_y_gastos(fecha_inicio, fecha_fin)
+    return _calcular_factor('servicios', df_ventas, df_gastos, por_sucursal)
 
 def calcular_factor_absorcion_repuestos(
     fecha_inicio: str = None,
@@ -81,57 +108,8 @@ def calcular_factor_absorcion_repuestos(
     Margen $ = Ingresos - Gastos Variables
     Resultado Operativo = Margen - Gastos Fijos
     """
-    df_ventas = get_ventas(fecha_inicio, fecha_fin)
-    gastos_totales = obtener_gastos_totales_con_automaticos(fecha_inicio, fecha_fin)
-    
-    df_gastos = gastos_totales['gastos_registrados']
-    if len(gastos_totales['gastos_automaticos']) > 0:
-        df_gastos = pd.concat([df_gastos, gastos_totales['gastos_automaticos']], ignore_index=True)
-    
-    gastos_fijos = df_gastos[df_gastos['tipo'] == 'FIJO']['total_pct_re'].sum() if len(df_gastos) > 0 else 0
-    gastos_variables = df_gastos[df_gastos['tipo'] == 'VARIABLE']['total_pct_re'].sum() if len(df_gastos) > 0 else 0
-    
-    if por_sucursal:
-        resultados = {}
-        sucursales = df_ventas['sucursal'].dropna().unique()
-        
-        for sucursal in sucursales:
-            df_ventas_suc = df_ventas[df_ventas['sucursal'] == sucursal]
-            ingresos_repuestos = df_ventas_suc[df_ventas_suc['tipo_re_se'] == 'RE']['total'].sum()
-            
-            df_gastos_suc = df_gastos[df_gastos['sucursal'] == sucursal]
-            gastos_fijos_suc = df_gastos_suc[df_gastos_suc['tipo'] == 'FIJO']['total_pct_re'].sum()
-            gastos_variables_suc = df_gastos_suc[df_gastos_suc['tipo'] == 'VARIABLE']['total_pct_re'].sum()
-            
-            factor_absorcion = (ingresos_repuestos / gastos_fijos_suc * 100) if gastos_fijos_suc > 0 else 0
-            margen = ingresos_repuestos - gastos_variables_suc
-            resultado_operativo = margen - gastos_fijos_suc
-            
-            resultados[sucursal] = {
-                'ingresos_repuestos': ingresos_repuestos,
-                'gastos_fijos': gastos_fijos_suc,
-                'gastos_variables': gastos_variables_suc,
-                'factor_absorcion': factor_absorcion,
-                'margen': margen,
-                'resultado_operativo': resultado_operativo
-            }
-        
-        return resultados
-    else:
-        ingresos_repuestos = df_ventas[df_ventas['tipo_re_se'] == 'RE']['total'].sum() if len(df_ventas) > 0 else 0
-        
-        factor_absorcion = (ingresos_repuestos / gastos_fijos * 100) if gastos_fijos > 0 else 0
-        margen = ingresos_repuestos - gastos_variables
-        resultado_operativo = margen - gastos_fijos
-        
-        return {
-            'ingresos_repuestos': ingresos_repuestos,
-            'gastos_fijos': gastos_fijos,
-            'gastos_variables': gastos_variables,
-            'factor_absorcion': factor_absorcion,
-            'margen': margen,
-            'resultado_operativo': resultado_operativo
-        }
+    df_ventas, df_gastos = _obtener_ventas_y_gastos(fecha_inicio, fecha_fin)
+    return _calcular_factor('repuestos', df_ventas, df_gastos, por_sucursal)
 
 def calcular_factor_absorcion_postventa(
     fecha_inicio: str = None,
@@ -145,61 +123,8 @@ def calcular_factor_absorcion_postventa(
     Margen $ = Ingresos - Gastos Variables
     Resultado Operativo = Margen - Gastos Fijos
     """
-    df_ventas = get_ventas(fecha_inicio, fecha_fin)
-    gastos_totales = obtener_gastos_totales_con_automaticos(fecha_inicio, fecha_fin)
-    
-    df_gastos = gastos_totales['gastos_registrados']
-    if len(gastos_totales['gastos_automaticos']) > 0:
-        df_gastos = pd.concat([df_gastos, gastos_totales['gastos_automaticos']], ignore_index=True)
-    
-    gastos_fijos = (df_gastos[df_gastos['tipo'] == 'FIJO']['total_pct_se'].sum() + 
-                   df_gastos[df_gastos['tipo'] == 'FIJO']['total_pct_re'].sum()) if len(df_gastos) > 0 else 0
-    gastos_variables = (df_gastos[df_gastos['tipo'] == 'VARIABLE']['total_pct_se'].sum() + 
-                       df_gastos[df_gastos['tipo'] == 'VARIABLE']['total_pct_re'].sum()) if len(df_gastos) > 0 else 0
-    
-    if por_sucursal:
-        resultados = {}
-        sucursales = df_ventas['sucursal'].dropna().unique()
-        
-        for sucursal in sucursales:
-            df_ventas_suc = df_ventas[df_ventas['sucursal'] == sucursal]
-            ingresos_totales = df_ventas_suc['total'].sum()
-            
-            df_gastos_suc = df_gastos[df_gastos['sucursal'] == sucursal]
-            gastos_fijos_suc = (df_gastos_suc[df_gastos_suc['tipo'] == 'FIJO']['total_pct_se'].sum() + 
-                               df_gastos_suc[df_gastos_suc['tipo'] == 'FIJO']['total_pct_re'].sum())
-            gastos_variables_suc = (df_gastos_suc[df_gastos_suc['tipo'] == 'VARIABLE']['total_pct_se'].sum() + 
-                                   df_gastos_suc[df_gastos_suc['tipo'] == 'VARIABLE']['total_pct_re'].sum())
-            
-            factor_absorcion = (ingresos_totales / gastos_fijos_suc * 100) if gastos_fijos_suc > 0 else 0
-            margen = ingresos_totales - gastos_variables_suc
-            resultado_operativo = margen - gastos_fijos_suc
-            
-            resultados[sucursal] = {
-                'ingresos_totales': ingresos_totales,
-                'gastos_fijos': gastos_fijos_suc,
-                'gastos_variables': gastos_variables_suc,
-                'factor_absorcion': factor_absorcion,
-                'margen': margen,
-                'resultado_operativo': resultado_operativo
-            }
-        
-        return resultados
-    else:
-        ingresos_totales = df_ventas['total'].sum() if len(df_ventas) > 0 else 0
-        
-        factor_absorcion = (ingresos_totales / gastos_fijos * 100) if gastos_fijos > 0 else 0
-        margen = ingresos_totales - gastos_variables
-        resultado_operativo = margen - gastos_fijos
-        
-        return {
-            'ingresos_totales': ingresos_totales,
-            'gastos_fijos': gastos_fijos,
-            'gastos_variables': gastos_variables,
-            'factor_absorcion': factor_absorcion,
-            'margen': margen,
-            'resultado_operativo': resultado_operativo
-        }
+    df_ventas, df_gastos = _obtener_ventas_y_gastos(fecha_inicio, fecha_fin)
+    return _calcular_factor('postventa', df_ventas, df_gastos, por_sucursal)
 
 def calcular_punto_equilibrio(
     fecha_inicio: str = None,
@@ -216,7 +141,7 @@ def calcular_punto_equilibrio(
     gastos_totales = obtener_gastos_totales_con_automaticos(fecha_inicio, fecha_fin)
     
     gastos_total = gastos_totales['gastos_postventa_total']
-    ingresos_actuales = df_ventas['total'].sum() if len(df_ventas) > 0 else 0
+    ingresos_actuales = df_ventas['total'].sum()
     
     if por_sucursal:
         resultados = {}
@@ -227,8 +152,8 @@ def calcular_punto_equilibrio(
             ingresos_suc = df_ventas_suc['total'].sum()
             
             df_gastos_suc = gastos_totales['gastos_todos']
-            df_gastos_suc = df_gastos_suc[df_gastos_suc['sucursal'] == sucursal] if len(df_gastos_suc) > 0 else pd.DataFrame()
-            gastos_suc = (df_gastos_suc['total_pct_se'].sum() + df_gastos_suc['total_pct_re'].sum()) if len(df_gastos_suc) > 0 else 0
+            df_gastos_suc = df_gastos_suc[df_gastos_suc['sucursal'] == sucursal]
+            gastos_suc = df_gastos_suc['total_pct_se'].sum() + df_gastos_suc['total_pct_re'].sum()
             
             diferencia = ingresos_suc - gastos_suc
             
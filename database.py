@@ -3,13 +3,20 @@ Módulo de gestión de base de datos con soporte para SQLite y PostgreSQL.
 Soporta backup automático y bases de datos persistentes para Streamlit Cloud.
 """
 import os
+import io
 import json
+import queue
 import re
 import shutil
 import sqlite3
-from datetime import datetime
+import threading
+from contextlib import closing, contextmanager
+from datetime import date, datetime
+from functools import partial, wraps
+from itertools import chain
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 try:
@@ -70,6 +77,10 @@ if USE_POSTGRES:
         ) from exc
 
 
+# Expresiones regulares usadas al limpiar valores monetarios importados
+_PREFIX_RE = re.compile(r'^[US\s$]*', re.IGNORECASE)  # prefijos "US $", "$", etc.
+_SIGNO_NEGATIVO_RE = re.compile(r'[-(]')
+
 # Detectar si estamos en Streamlit Cloud
 IS_STREAMLIT_CLOUD = os.environ.get("STREAMLIT_SERVER_ENVIRONMENT") == "cloud"
 
@@ -77,6 +88,28 @@ IS_STREAMLIT_CLOUD = os.environ.get("STREAMLIT_SERVER_ENVIRONMENT") == "cloud"
 DB_PATH = Path("postventa.db")
 BACKUP_DIR = Path("backups")
 BACKUP_DIR.mkdir(exist_ok=True)
+# Tamaño de bloque al copiar archivos .db recibidos
+COPIA_BLOQUE_BYTES = 1 << 20
+
+# Pool de conexiones reutilizables (LIFO para reusar la conexión más reciente)
+POOL_SIZE = 8
+_POOL = queue.LifoQueue(maxsize=POOL_SIZE)
+
+# Violaciones de restricciones (UNIQUE, NOT NULL) según el motor
+ERRORES_INTEGRIDAD = (psycopg2.IntegrityError,) if USE_POSTGRES else (sqlite3.IntegrityError,)
+
+# DELETE/INSERT ... RETURNING (SQLite >= 3.35)
+SOPORTA_RETURNING = USE_POSTGRES or sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Parámetros por sentencia en SQLite (SQLITE_MAX_VARIABLE_NUMBER: 32766 desde 3.32, antes 999);
+# limita cuántas filas entran en un INSERT multi-fila
+SQLITE_MAX_PARAMETROS = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+SQLITE_FILAS_POR_INSERT = 500
+
+# Versión de los datos (ventas, gastos, plantillas): cada escritura la incrementa e invalida la caché de lecturas
+_VERSION_DATOS = 0
+# Tope de vida de la caché, por si otro proceso escribe en la base (p. ej. Postgres compartido)
+CACHE_TTL_SEGUNDOS = 300
 
 
 VENTAS_TABLE_SQLITE = """
@@ -193,7 +226,8 @@ PLANTILLAS_TABLE_SQLITE = """
         detalles TEXT,
         activa INTEGER DEFAULT 1,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        nombre_clave TEXT
     )
 """
 
@@ -213,7 +247,8 @@ PLANTILLAS_TABLE_PG = """
         detalles TEXT,
         activa BOOLEAN DEFAULT TRUE,
         created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        nombre_clave TEXT
     )
 """
 
@@ -242,6 +277,138 @@ HISTORIAL_TABLE_PG = """
 """
 
 
+VENTAS_NUMERIC_COLS = ["mano_obra", "asistencia", "repuestos", "terceros", "descuento", "total"]
+
+GASTOS_NUMERIC_COLS = [
+    "total_pesos",
+    "total_usd",
+    "total_pct",
+    "total_pct_se",
+    "total_pct_re",
+    "pct_postventa",
+    "pct_servicios",
+    "pct_repuestos",
+]
+
+
+# Columnas (en orden) y valores por defecto para las inserciones masivas
+VENTAS_INSERT_COLS = (
+    "mes", "fecha", "sucursal", "cliente", "pin", "comprobante", "tipo_comprobante",
+    "trabajo", "n_comprobante", "tipo_re_se", "mano_obra", "asistencia",
+    "repuestos", "terceros", "descuento", "total", "detalles", "archivo_comprobante", "campo_taller",
+)
+VENTAS_DEFAULTS = {"mano_obra": 0, "asistencia": 0, "repuestos": 0, "terceros": 0, "descuento": 0, "total": 0}
+
+GASTOS_INSERT_COLS = (
+    "mes", "fecha", "sucursal", "area", "pct_postventa", "pct_servicios",
+    "pct_repuestos", "tipo", "clasificacion", "proveedor", "total_pesos",
+    "total_usd", "total_pct", "total_pct_se", "total_pct_re", "detalles",
+)
+GASTOS_DEFAULTS = {
+    "pct_postventa": 0, "pct_servicios": 0, "pct_repuestos": 0,
+    "total_usd": 0, "total_pct": 0, "total_pct_se": 0, "total_pct_re": 0,
+}
+
+# Columnas consultables en get_ventas/get_gastos (lista blanca para la proyección)
+VENTAS_SELECT_COLS = ("id", *VENTAS_INSERT_COLS, "created_at")
+GASTOS_SELECT_COLS = ("id", *GASTOS_INSERT_COLS, "created_at")
+
+# Proyección angosta para totales/conteos: evita leer columnas de texto anchas (detalles, etc.)
+VENTAS_RESUMEN_COLS = ("id", "fecha", *VENTAS_NUMERIC_COLS)
+GASTOS_RESUMEN_COLS = ("id", "fecha", *GASTOS_NUMERIC_COLS)
+
+PLANTILLAS_INSERT_COLS = (
+    "nombre", "descripcion", "sucursal", "area", "pct_postventa", "pct_servicios",
+    "pct_repuestos", "tipo", "clasificacion", "proveedor", "detalles", "activa",
+)
+PLANTILLAS_DEFAULTS = {"pct_postventa": 0, "pct_servicios": 0, "pct_repuestos": 0, "activa": 1}
+# nombre_clave la calcula _clave_nombre_plantilla al escribir; no se expone en las lecturas
+PLANTILLAS_ESCRITURA_COLS = (*PLANTILLAS_INSERT_COLS, "nombre_clave")
+PLANTILLAS_SELECT_COLS = ("id", *PLANTILLAS_INSERT_COLS, "created_at", "updated_at")
+
+# Filas por bloque al leer ventas/gastos con iter_ventas/iter_gastos
+READ_CHUNK_SIZE = 10_000
+
+# Filas por cada executemany durante las importaciones (acota la memoria del driver)
+IMPORT_BATCH_SIZE = 5000
+
+# A partir de cuántas filas importadas se recalculan las estadísticas del planificador
+ANALYZE_MIN_FILAS = 1000
+
+
+# Índices para los filtros por rango de fecha + ORDER BY fecha DESC, id DESC
+# (sintaxis válida tanto en SQLite como en PostgreSQL)
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS idx_ventas_fecha_id ON ventas(fecha DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_gastos_fecha_id ON gastos(fecha DESC, id DESC)",
+    # Tableros agrupados por sucursal dentro de un rango de fechas
+    "CREATE INDEX IF NOT EXISTS idx_gastos_sucursal_fecha ON gastos(sucursal, fecha)",
+    # Historial de IA: resumen mensual por rango y listado ORDER BY fecha_hora DESC
+    "CREATE INDEX IF NOT EXISTS idx_hia_fecha ON historial_analisis_ia(fecha_hora)",
+]
+
+# Clave natural de ventas: reimportar el mismo Excel no duplica comprobantes.
+# Es parcial: las filas sin número de comprobante no tienen clave y no se deduplican.
+# Rige también para la carga y edición manual (insert_venta / update_venta).
+NOMBRE_INDICE_VENTAS_COMPROBANTE = "idx_ventas_comprobante_unico"
+INDICE_VENTAS_COMPROBANTE = f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS {NOMBRE_INDICE_VENTAS_COMPROBANTE} ON ventas(
+        fecha, COALESCE(sucursal, ''), COALESCE(tipo_comprobante, ''),
+        n_comprobante, COALESCE(tipo_re_se, ''), total
+    )
+    WHERE n_comprobante IS NOT NULL AND n_comprobante <> ''
+"""
+
+# Nombres de plantilla únicos sin distinguir mayúsculas; destino del UPSERT de importar_plantillas_gastos
+INDICE_PLANTILLAS_NOMBRE_CLAVE = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_plantillas_nombre_clave ON plantillas_gastos(nombre_clave)"
+)
+
+# Migraciones de esquema SQLite; PRAGMA user_version guarda cuántas ya se aplicaron.
+# Cada entrada es la lista de sentencias de una versión: agregar al final, nunca reordenar.
+MIGRACIONES_SQLITE = [
+    [
+        "ALTER TABLE ventas ADD COLUMN archivo_comprobante TEXT",
+        "ALTER TABLE ventas ADD COLUMN campo_taller TEXT",
+    ],
+    # Versión 2 (columna generada nombre_lc) reemplazada por nombre_clave: el lower() de SQLite
+    # solo pasa a minúsculas ASCII y no coincidía con str.lower() en nombres acentuados
+    [],
+    [
+        "DROP INDEX IF EXISTS idx_plantillas_nombre_lc",
+        "ALTER TABLE plantillas_gastos ADD COLUMN nombre_clave TEXT",
+    ],
+]
+
+# WAL + synchronous=NORMAL: lectores y escritor concurrentes, menos fsync por commit.
+# journal_mode queda guardado en el archivo; el resto se aplica a cada conexión nueva.
+SQLITE_PRAGMAS = [
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64 MiB de caché de páginas
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA wal_autocheckpoint=1000",
+]
+_WAL_SET = False
+
+# SQLite admite un solo escritor: las escrituras del proceso hacen cola aquí en lugar de
+# competir por el lock del archivo y reintentar con el busy handler.
+_WRITE_LOCK = threading.RLock()
+
+
+def _escritura(func):
+    """Serializa la función de escritura dentro del proceso (solo SQLite)"""
+    if USE_POSTGRES:
+        return func
+
+    @wraps(func)
+    def envoltura(*args, **kwargs):
+        with _WRITE_LOCK:
+            return func(*args, **kwargs)
+    return envoltura
+
+
 def _prepare_query(query: str) -> str:
     if USE_POSTGRES:
         return query.replace("?", "%s")
@@ -264,14 +431,32 @@ def _execute(cursor, query: str, params=None):
         cursor.execute(query, _convert_params(params))
 
 
+def _fetch_df(cursor, filas) -> pd.DataFrame:
+    # from_records directo: sin la capa SQL de pandas y válido también para RealDictCursor
+    columnas = [desc[0] for desc in cursor.description]
+    return pd.DataFrame.from_records(filas, columns=columnas, coerce_float=True)
+
+
 def _read_sql(query: str, conn, params=None):
-    query = _prepare_query(query)
-    if USE_POSTGRES:
-        # pandas no funciona bien con conexiones que usan RealDictCursor,
-        # así que abrimos una conexión simple solo para lecturas con pandas
-        with psycopg2.connect(POSTGRES_URL) as tmp_conn:
-            return pd.read_sql_query(query, tmp_conn, params=_convert_params(params))
-    return pd.read_sql_query(query, conn, params=_convert_params(params))
+    cursor = conn.cursor()
+    _execute(cursor, query, params)
+    return _fetch_df(cursor, cursor.fetchall())
+
+
+def _iter_sql(query: str, conn, params=None, chunksize=None):
+    cursor = conn.cursor()
+    _execute(cursor, query, params)
+    if not chunksize:
+        yield _fetch_df(cursor, cursor.fetchall())
+        return
+    filas = cursor.fetchmany(chunksize)
+    # Siempre al menos un bloque (vacío) para conservar las columnas
+    yield _fetch_df(cursor, filas)
+    while len(filas) == chunksize:
+        filas = cursor.fetchmany(chunksize)
+        if not filas:
+            return
+        yield _fetch_df(cursor, filas)
 
 
 def _sanitize_dataframe(df: pd.DataFrame, numeric_cols: list[str]) -> pd.DataFrame:
@@ -305,6 +490,189 @@ def _sanitize_dataframe(df: pd.DataFrame, numeric_cols: list[str]) -> pd.DataFra
     return df
 
 
+def _select_columnas(columns, permitidas) -> str:
+    if not columns:
+        return "*"
+    desconocidas = [col for col in columns if col not in permitidas]
+    if desconocidas:
+        raise ValueError(f"Columnas desconocidas: {', '.join(desconocidas)}")
+    return ", ".join(columns)
+
+
+def _query_por_fecha(table: str, columns, permitidas, fecha_inicio=None, fecha_fin=None, filtro=None, filtro_params=()):
+    query = f"SELECT {_select_columnas(columns, permitidas)} FROM {table} WHERE 1=1"
+    params = []
+
+    if fecha_inicio:
+        query += " AND fecha >= ?"
+        params.append(fecha_inicio)
+
+    if fecha_fin:
+        query += " AND fecha <= ?"
+        params.append(fecha_fin)
+
+    if filtro:
+        query += f" AND {filtro}"
+        params.extend(filtro_params)
+
+    query += " ORDER BY fecha DESC, id DESC"
+    return query, params
+
+
+def _iter_tabla(query: str, params, numeric_cols, chunksize):
+    with get_connection() as conn:
+        inicio = 0
+        for chunk in _iter_sql(query, conn, params, chunksize):
+            # Índice continuo entre bloques, como si se hubiera leído todo de una vez
+            chunk.index += inicio
+            inicio += len(chunk)
+            yield _sanitize_dataframe(chunk, numeric_cols)
+
+
+def _concat_bloques(bloques) -> pd.DataFrame:
+    bloques = list(bloques)
+    if not bloques:
+        return pd.DataFrame()
+    if len(bloques) == 1:
+        return bloques[0]
+    return pd.concat(bloques)
+
+
+def _insert_sql(table: str, columns, ignorar_duplicados: bool = False, filas: int = 1) -> str:
+    placeholders = ", ".join("?" for _ in columns)
+    valores = ", ".join([f"({placeholders})"] * filas)
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {valores}"
+    if ignorar_duplicados:
+        # Sintaxis común a SQLite (>= 3.24) y PostgreSQL
+        query += " ON CONFLICT DO NOTHING"
+    return query
+
+
+def _update_sql(table: str, columns, extra_set: str = "") -> str:
+    asignaciones = ", ".join(f"{col} = ?" for col in columns)
+    return f"UPDATE {table} SET {asignaciones}{extra_set} WHERE id = ?"
+
+
+def _row_params(data: dict, columns, defaults: dict) -> tuple:
+    return tuple(data.get(col, defaults.get(col)) for col in columns)
+
+
+def _clave_nombre_plantilla(nombre) -> str:
+    """Nombre de plantilla normalizado para compararlo sin distinguir mayúsculas (incluye acentuadas)"""
+    return (nombre or "").strip().lower()
+
+
+def _plantilla_params(data: dict) -> tuple:
+    """Parámetros en orden PLANTILLAS_ESCRITURA_COLS"""
+    return _row_params(data, PLANTILLAS_INSERT_COLS, PLANTILLAS_DEFAULTS) + (
+        _clave_nombre_plantilla(data.get("nombre")),
+    )
+
+
+def _insert_returning_id(cursor, query: str, params) -> int:
+    if USE_POSTGRES:
+        _execute(cursor, query + " RETURNING id", params)
+        return cursor.fetchone()["id"]
+    _execute(cursor, query, params)
+    return cursor.lastrowid
+
+
+# Sentencias armadas una sola vez: mismo texto SQL en cada llamada (reutiliza la caché de sentencias)
+INSERT_VENTA_SQL = _insert_sql("ventas", VENTAS_INSERT_COLS)
+UPDATE_VENTA_SQL = _update_sql("ventas", VENTAS_INSERT_COLS)
+INSERT_GASTO_SQL = _insert_sql("gastos", GASTOS_INSERT_COLS)
+UPDATE_GASTO_SQL = _update_sql("gastos", GASTOS_INSERT_COLS)
+INSERT_PLANTILLA_SQL = _insert_sql("plantillas_gastos", PLANTILLAS_ESCRITURA_COLS)
+UPDATE_PLANTILLA_SQL = _update_sql(
+    "plantillas_gastos", PLANTILLAS_ESCRITURA_COLS, extra_set=", updated_at = CURRENT_TIMESTAMP"
+)
+
+
+def _executemany_insert(conn, sql_para_filas, rows, num_columnas: int) -> int:
+    """
+    Ejecuta un INSERT para todas las filas y devuelve cuántas se insertaron/actualizaron.
+    `sql_para_filas(n)` arma la sentencia con n grupos VALUES. En SQLite se envían bloques
+    multi-fila (un solo execute por bloque); en Postgres, executemany fila a fila.
+    """
+    cursor = conn.cursor()
+    if USE_POSTGRES:
+        cursor.executemany(_prepare_query(sql_para_filas(1)), rows)
+        return cursor.rowcount
+    por_sentencia = max(1, min(SQLITE_FILAS_POR_INSERT, SQLITE_MAX_PARAMETROS // num_columnas))
+    afectadas = 0
+    for inicio in range(0, len(rows), por_sentencia):
+        bloque = rows[inicio:inicio + por_sentencia]
+        cursor.execute(sql_para_filas(len(bloque)), list(chain.from_iterable(bloque)))
+        afectadas += cursor.rowcount
+    return afectadas
+
+
+def _insert_ventas_many(conn, rows):
+    """Inserta varias ventas (tuplas en orden VENTAS_INSERT_COLS) sin hacer commit, omitiendo comprobantes ya cargados"""
+    return _executemany_insert(
+        conn,
+        lambda filas: _insert_sql("ventas", VENTAS_INSERT_COLS, ignorar_duplicados=True, filas=filas),
+        rows,
+        len(VENTAS_INSERT_COLS),
+    )
+
+
+def _insert_gastos_many(conn, rows):
+    """Inserta varios gastos (tuplas en orden GASTOS_INSERT_COLS) sin hacer commit"""
+    return _executemany_insert(
+        conn, lambda filas: _insert_sql("gastos", GASTOS_INSERT_COLS, filas=filas), rows, len(GASTOS_INSERT_COLS)
+    )
+
+
+def _upsert_plantillas_many(conn, rows, sobrescribir=True):
+    """
+    Inserta varias plantillas en orden PLANTILLAS_ESCRITURA_COLS, sin hacer commit. Si el nombre ya existe
+    (sin distinguir mayúsculas) la plantilla se actualiza con `sobrescribir`; si no, queda intacta.
+    """
+    if sobrescribir:
+        actualizar = ", ".join(f"{col} = excluded.{col}" for col in PLANTILLAS_INSERT_COLS if col != "nombre")
+        conflicto = f" ON CONFLICT (nombre_clave) DO UPDATE SET {actualizar}, updated_at = CURRENT_TIMESTAMP"
+    else:
+        conflicto = " ON CONFLICT (nombre_clave) DO NOTHING"
+    return _executemany_insert(
+        conn,
+        lambda filas: _insert_sql("plantillas_gastos", PLANTILLAS_ESCRITURA_COLS, filas=filas) + conflicto,
+        rows,
+        len(PLANTILLAS_ESCRITURA_COLS),
+    )
+
+
+@_escritura
+def _insert_many_en_transaccion(insert_many, rows):
+    """Inserta todas las filas en lotes de IMPORT_BATCH_SIZE dentro de una única transacción"""
+    if not rows:
+        return 0
+    insertadas = 0
+    with get_connection() as conn:
+        try:
+            if not USE_POSTGRES:
+                # Tomar el lock de escritura desde el inicio: todos los lotes, un único commit
+                conn.execute("BEGIN IMMEDIATE")
+            for inicio in range(0, len(rows), IMPORT_BATCH_SIZE):
+                insertadas += insert_many(conn, rows[inicio:inicio + IMPORT_BATCH_SIZE])
+            conn.commit()
+            _datos_modificados()
+        except Exception:
+            conn.rollback()
+            raise
+    return insertadas
+
+
+@_escritura
+def _actualizar_estadisticas(table: str, filas: int):
+    """Recalcula las estadísticas del planificador tras una importación grande"""
+    if filas < ANALYZE_MIN_FILAS:
+        return
+    with get_connection() as conn:
+        conn.cursor().execute(f"ANALYZE {table}")
+        conn.commit()
+
+
 def _fetch_scalar(cursor, default=0):
     row = cursor.fetchone()
     if row is None:
@@ -314,243 +682,337 @@ def _fetch_scalar(cursor, default=0):
     return row[0]
 
 
-def get_connection():
-    """Obtiene una conexión a la base de datos"""
+def _abrir_conexion():
+    """Abre una conexión nueva a la base de datos"""
     if USE_POSTGRES:
-        conn = psycopg2.connect(
+        return psycopg2.connect(
             POSTGRES_URL,
             cursor_factory=psycopg2.extras.RealDictCursor,
         )
-        return conn
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    # Filas como tuplas (lo más barato para DataFrames); _cursor_por_nombre da sqlite3.Row donde hace falta
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    _configurar_sqlite(conn)
     return conn
 
-def init_database():
-    """Inicializa las tablas de la base de datos"""
-    conn = get_connection()
+
+def _cursor_por_nombre(conn):
+    """Cursor cuyas filas se leen por nombre de columna (sqlite3.Row o dict en Postgres)"""
     cursor = conn.cursor()
+    if not USE_POSTGRES:
+        cursor.row_factory = sqlite3.Row
+    return cursor
 
-    if USE_POSTGRES:
-        _execute(cursor, VENTAS_TABLE_PG)
-        # Agregar columnas si no existen (para bases de datos existentes)
+
+def _configurar_sqlite(conn):
+    """Aplica los PRAGMA de rendimiento a una conexión SQLite nueva"""
+    global _WAL_SET
+    if not _WAL_SET:
+        # Persistente por archivo: alcanza con fijarlo una vez por proceso
+        conn.execute("PRAGMA journal_mode=WAL")
+        _WAL_SET = True
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+
+
+def _devolver_conexion(conn):
+    """Devuelve la conexión al pool, descartándola si quedó inutilizable"""
+    try:
+        # Descartar cualquier transacción que haya quedado abierta
+        conn.rollback()
+    except Exception:
         try:
-            # Verificar si archivo_comprobante existe
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='ventas' AND column_name='archivo_comprobante'
-            """)
-            if cursor.fetchone() is None:
-                _execute(cursor, "ALTER TABLE ventas ADD COLUMN archivo_comprobante TEXT")
+            conn.close()
         except Exception:
-            pass  # La columna ya existe o hay un error
-        
+            pass
+        return
+    if USE_POSTGRES and conn.closed:
+        return
+    try:
+        _POOL.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+@contextmanager
+def get_connection():
+    """Obtiene una conexión del pool (se devuelve al salir del bloque with)"""
+    try:
+        conn = _POOL.get_nowait()
+    except queue.Empty:
+        conn = _abrir_conexion()
+    try:
+        yield conn
+    finally:
+        _devolver_conexion(conn)
+
+
+def cerrar_conexiones():
+    """Cierra todas las conexiones del pool"""
+    while True:
         try:
-            # Verificar si campo_taller existe
+            conn = _POOL.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def _datos_modificados():
+    """Invalida las lecturas cacheadas tras una escritura"""
+    global _VERSION_DATOS
+    _VERSION_DATOS += 1
+
+
+def _fecha_clave(valor):
+    """Normaliza date a 'YYYY-MM-DD' para que '2024-01-01' y date(2024, 1, 1) compartan entrada de caché"""
+    if isinstance(valor, date) and not isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+def _cache_lecturas(func):
+    """Cachea la lectura con st.cache_data cuando Streamlit está disponible"""
+    if st is None:
+        return func
+    return st.cache_data(show_spinner=False, ttl=CACHE_TTL_SEGUNDOS, max_entries=32)(func)
+
+def _migrar_sqlite(cursor):
+    """Aplica las migraciones pendientes según PRAGMA user_version"""
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+    for numero, sentencias in enumerate(MIGRACIONES_SQLITE[version:], start=version + 1):
+        for sentencia in sentencias:
+            try:
+                _execute(cursor, sentencia)
+            except sqlite3.OperationalError as e:
+                # Bases creadas antes de versionar el esquema: la columna ya existe.
+                # Cualquier otro error se propaga y la versión queda sin marcar para reintentarla.
+                if "duplicate column name" not in str(e):
+                    raise
+        cursor.execute(f"PRAGMA user_version = {numero}")
+
+def _normalizar_claves_plantillas(conn):
+    """
+    Completa nombre_clave donde falta o quedó desactualizada (filas migradas o escritas por fuera de
+    este módulo). Si dos plantillas solo difieren en mayúsculas ("Alq"/"alq"), la más antigua conserva
+    el nombre y las demás se renombran con su id ("alq (7)"), para poder crear el índice único.
+    """
+    cursor = _cursor_por_nombre(conn)
+    cursor.execute("SELECT id, nombre, nombre_clave FROM plantillas_gastos ORDER BY id")
+    claves_vistas = set()
+    renombradas = []
+    claves = []
+    for row in cursor.fetchall():
+        nombre = row["nombre"]
+        clave = _clave_nombre_plantilla(nombre)
+        if clave in claves_vistas:
+            nombre = f"{nombre} ({row['id']})"
+            clave = _clave_nombre_plantilla(nombre)
+            renombradas.append((nombre, clave, row["id"]))
+        elif clave != row["nombre_clave"]:
+            claves.append((clave, row["id"]))
+        claves_vistas.add(clave)
+    if renombradas:
+        cursor.executemany(
+            _prepare_query("UPDATE plantillas_gastos SET nombre = ?, nombre_clave = ? WHERE id = ?"), renombradas
+        )
+        print(f"Plantillas renombradas por nombre repetido (sin distinguir mayúsculas): {len(renombradas)}")
+    if claves:
+        cursor.executemany(_prepare_query("UPDATE plantillas_gastos SET nombre_clave = ? WHERE id = ?"), claves)
+
+@_escritura
+def init_database():
+    """Inicializa las tablas de la base de datos"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        if USE_POSTGRES:
+            _execute(cursor, VENTAS_TABLE_PG)
+            # Agregar columnas si no existen (para bases de datos existentes)
+            try:
+                # Verificar si archivo_comprobante existe
+                cursor.execute("""
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE table_name='ventas' AND column_name='archivo_comprobante'
+                """)
+                if cursor.fetchone() is None:
+                    _execute(cursor, "ALTER TABLE ventas ADD COLUMN archivo_comprobante TEXT")
+            except Exception:
+                pass  # La columna ya existe o hay un error
+        
+            try:
+                # Verificar si campo_taller existe
+                cursor.execute("""
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE table_name='ventas' AND column_name='campo_taller'
+                """)
+                if cursor.fetchone() is None:
+                    _execute(cursor, "ALTER TABLE ventas ADD COLUMN campo_taller TEXT")
+            except Exception:
+                pass  # La columna ya existe o hay un error
+        
+            _execute(cursor, GASTOS_TABLE_PG)
+            _execute(cursor, PLANTILLAS_TABLE_PG)
+            _execute(cursor, HISTORIAL_TABLE_PG)
+
             cursor.execute("""
                 SELECT column_name 
                 FROM information_schema.columns 
-                WHERE table_name='ventas' AND column_name='campo_taller'
+                WHERE table_name='plantillas_gastos' AND column_name='nombre_clave'
             """)
             if cursor.fetchone() is None:
-                _execute(cursor, "ALTER TABLE ventas ADD COLUMN campo_taller TEXT")
-        except Exception:
-            pass  # La columna ya existe o hay un error
-        
-        _execute(cursor, GASTOS_TABLE_PG)
-        _execute(cursor, PLANTILLAS_TABLE_PG)
-        _execute(cursor, HISTORIAL_TABLE_PG)
-    else:
-        _execute(cursor, VENTAS_TABLE_SQLITE)
-        # Agregar columnas si no existen (para bases de datos existentes)
+                _execute(cursor, "ALTER TABLE plantillas_gastos ADD COLUMN nombre_clave TEXT")
+                # Reemplaza a la columna generada nombre_lc (se elimina junto con su índice)
+                _execute(cursor, "ALTER TABLE plantillas_gastos DROP COLUMN IF EXISTS nombre_lc")
+        else:
+            _execute(cursor, VENTAS_TABLE_SQLITE)
+            _execute(cursor, GASTOS_TABLE_SQLITE)
+            _execute(cursor, PLANTILLAS_TABLE_SQLITE)
+            _execute(cursor, HISTORIAL_TABLE_SQLITE)
+            # Agregar columnas a bases existentes, solo si el esquema guardado es anterior
+            _migrar_sqlite(cursor)
+    
+        for indice in INDICES:
+            _execute(cursor, indice)
+    
+        if not USE_POSTGRES:
+            # Estadísticas iniciales para el planificador (luego las refrescan las importaciones grandes)
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                cursor.execute("ANALYZE")
+    
+        conn.commit()
+
         try:
-            _execute(cursor, "ALTER TABLE ventas ADD COLUMN archivo_comprobante TEXT")
-        except sqlite3.OperationalError:
-            pass  # La columna ya existe
+            _execute(cursor, INDICE_VENTAS_COMPROBANTE)
+            conn.commit()
+        except Exception as e:
+            # Bases con comprobantes ya duplicados: siguen funcionando, sin deduplicar reimportaciones
+            conn.rollback()
+            print(f"No se pudo crear el índice único de comprobantes: {e}")
+
         try:
-            _execute(cursor, "ALTER TABLE ventas ADD COLUMN campo_taller TEXT")
-        except sqlite3.OperationalError:
-            pass  # La columna ya existe
-        _execute(cursor, GASTOS_TABLE_SQLITE)
-        _execute(cursor, PLANTILLAS_TABLE_SQLITE)
-        _execute(cursor, HISTORIAL_TABLE_SQLITE)
-    
-    conn.commit()
-    conn.close()
+            _normalizar_claves_plantillas(conn)
+            _execute(cursor, INDICE_PLANTILLAS_NOMBRE_CLAVE)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"No se pudo crear el índice único de nombres de plantilla: {e}")
 
-def get_ventas(fecha_inicio=None, fecha_fin=None):
-    """Obtiene todas las ventas, opcionalmente filtradas por fecha"""
-    conn = get_connection()
-    
-    query = "SELECT * FROM ventas WHERE 1=1"
-    params = []
-    
-    if fecha_inicio:
-        query += " AND fecha >= ?"
-        params.append(fecha_inicio)
-    
-    if fecha_fin:
-        query += " AND fecha <= ?"
-        params.append(fecha_fin)
-    
-    query += " ORDER BY fecha DESC, id DESC"
-    
-    df = _read_sql(query, conn, params)
-    if len(df):
-        df = _sanitize_dataframe(
-            df,
-            ["mano_obra", "asistencia", "repuestos", "terceros", "descuento", "total"],
-        )
-    conn.close()
+def get_ventas(fecha_inicio=None, fecha_fin=None, columns=None, chunksize=None):
+    """
+    Obtiene todas las ventas, opcionalmente filtradas por fecha y limitando las columnas leídas.
+    Con `chunksize` devuelve un generador de DataFrames (ver iter_ventas) en lugar de uno solo.
+    """
+    if chunksize:
+        return iter_ventas(fecha_inicio, fecha_fin, chunksize=chunksize, columns=columns)
+    columns = tuple(columns) if columns else None
+    return _get_ventas_cacheado(_fecha_clave(fecha_inicio), _fecha_clave(fecha_fin), columns, _VERSION_DATOS)
+
+@_cache_lecturas
+def _get_ventas_cacheado(fecha_inicio, fecha_fin, columns, version):
+    return _concat_bloques(iter_ventas(fecha_inicio, fecha_fin, columns=columns))
+
+def iter_ventas(fecha_inicio=None, fecha_fin=None, chunksize=READ_CHUNK_SIZE, columns=None):
+    """Recorre las ventas en bloques de `chunksize` filas, sin cargar toda la tabla en memoria"""
+    query, params = _query_por_fecha("ventas", columns, VENTAS_SELECT_COLS, fecha_inicio, fecha_fin)
+    yield from _iter_tabla(query, params, VENTAS_NUMERIC_COLS, chunksize)
+
+def list_recent_ventas(limit=50):
+    """Obtiene las ventas más recientes (vista previa), sin leer toda la tabla"""
+    with get_connection() as conn:
+        df = _read_sql("SELECT * FROM ventas ORDER BY fecha DESC, id DESC LIMIT ?", conn, [limit])
+        if len(df):
+            df = _sanitize_dataframe(df, VENTAS_NUMERIC_COLS)
     
     return df
 
-def get_venta_by_id(venta_id):
-    """Obtiene una venta por su ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    _execute(cursor, "SELECT * FROM ventas WHERE id = ?", (venta_id,))
-    row = cursor.fetchone()
-    conn.close()
+def list_recent_venta_ids(limit=500):
+    """Obtiene los IDs de las ventas más recientes (para selectores)"""
+    with get_connection() as conn:
+        cursor = _cursor_por_nombre(conn)
+        _execute(cursor, "SELECT id FROM ventas ORDER BY fecha DESC, id DESC LIMIT ?", (limit,))
+        ids = [row["id"] for row in cursor.fetchall()]
+    
+    return ids
+
+def get_venta_by_id(venta_id, fields=None):
+    """Obtiene una venta por su ID; con `fields` lee solo esas columnas"""
+    columnas = _select_columnas(fields, VENTAS_SELECT_COLS)
+    with get_connection() as conn:
+        cursor = _cursor_por_nombre(conn)
+        _execute(cursor, f"SELECT {columnas} FROM ventas WHERE id = ?", (venta_id,))
+        row = cursor.fetchone()
     
     if row:
         return dict(row)
     return None
 
+def _error_comprobante_duplicado(exc):
+    """Traduce la violación del índice único de comprobantes a un error legible; None si es otra restricción"""
+    if NOMBRE_INDICE_VENTAS_COMPROBANTE in str(exc):
+        return ValueError(
+            "El comprobante ya está registrado (misma fecha, sucursal, tipo, número, RE/SE y total)"
+        )
+    return None
+
+@_escritura
 def insert_venta(venta_data):
-    """Inserta una nueva venta"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    """Inserta una nueva venta; ValueError si el comprobante ya está registrado"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    # Verificar y agregar columna campo_taller si no existe
-    try:
-        if USE_POSTGRES:
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='ventas' AND column_name='campo_taller'
-            """)
-            if cursor.fetchone() is None:
-                _execute(cursor, "ALTER TABLE ventas ADD COLUMN campo_taller TEXT")
-                conn.commit()
-        else:
-            try:
-                _execute(cursor, "ALTER TABLE ventas ADD COLUMN campo_taller TEXT")
-                conn.commit()
-            except sqlite3.OperationalError:
-                pass  # La columna ya existe
-    except Exception:
-        pass  # Si hay error, continuar (la columna puede ya existir)
-    
-    insert_sql = """
-        INSERT INTO ventas (
-            mes, fecha, sucursal, cliente, pin, comprobante, tipo_comprobante,
-            trabajo, n_comprobante, tipo_re_se, mano_obra, asistencia,
-            repuestos, terceros, descuento, total, detalles, archivo_comprobante, campo_taller
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """
-    params = (
-        venta_data.get('mes'),
-        venta_data.get('fecha'),
-        venta_data.get('sucursal'),
-        venta_data.get('cliente'),
-        venta_data.get('pin'),
-        venta_data.get('comprobante'),
-        venta_data.get('tipo_comprobante'),
-        venta_data.get('trabajo'),
-        venta_data.get('n_comprobante'),
-        venta_data.get('tipo_re_se'),
-        venta_data.get('mano_obra', 0),
-        venta_data.get('asistencia', 0),
-        venta_data.get('repuestos', 0),
-        venta_data.get('terceros', 0),
-        venta_data.get('descuento', 0),
-        venta_data.get('total', 0),
-        venta_data.get('detalles'),
-        venta_data.get('archivo_comprobante'),
-        venta_data.get('campo_taller')
-    )
-
-    if USE_POSTGRES:
-        insert_sql = insert_sql.replace("?)", "?) RETURNING id")
-        _execute(cursor, insert_sql, params)
-        venta_id = cursor.fetchone()["id"]
-    else:
-        _execute(cursor, insert_sql, params)
-        venta_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        try:
+            venta_id = _insert_returning_id(
+                cursor, INSERT_VENTA_SQL, _row_params(venta_data, VENTAS_INSERT_COLS, VENTAS_DEFAULTS)
+            )
+        except ERRORES_INTEGRIDAD as e:
+            error = _error_comprobante_duplicado(e)
+            if error is None:
+                raise
+            raise error from e
+        conn.commit()
+        _datos_modificados()
     
     return venta_id
 
+@_escritura
 def update_venta(venta_id, venta_data):
-    """Actualiza una venta existente"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    """Actualiza una venta existente; ValueError si queda igual a otro comprobante registrado"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    # Verificar y agregar columna campo_taller si no existe
-    try:
-        if USE_POSTGRES:
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='ventas' AND column_name='campo_taller'
-            """)
-            if cursor.fetchone() is None:
-                _execute(cursor, "ALTER TABLE ventas ADD COLUMN campo_taller TEXT")
-                conn.commit()
-        else:
-            try:
-                _execute(cursor, "ALTER TABLE ventas ADD COLUMN campo_taller TEXT")
-                conn.commit()
-            except sqlite3.OperationalError:
-                pass  # La columna ya existe
-    except Exception:
-        pass  # Si hay error, continuar (la columna puede ya existir)
-    
-    _execute(cursor, """
-        UPDATE ventas SET
-            mes = ?, fecha = ?, sucursal = ?, cliente = ?, pin = ?,
-            comprobante = ?, tipo_comprobante = ?, trabajo = ?,
-            n_comprobante = ?, tipo_re_se = ?, mano_obra = ?,
-            asistencia = ?, repuestos = ?, terceros = ?, descuento = ?,
-            total = ?, detalles = ?, archivo_comprobante = ?, campo_taller = ?
-        WHERE id = ?
-    """, (
-        venta_data.get('mes'),
-        venta_data.get('fecha'),
-        venta_data.get('sucursal'),
-        venta_data.get('cliente'),
-        venta_data.get('pin'),
-        venta_data.get('comprobante'),
-        venta_data.get('tipo_comprobante'),
-        venta_data.get('trabajo'),
-        venta_data.get('n_comprobante'),
-        venta_data.get('tipo_re_se'),
-        venta_data.get('mano_obra', 0),
-        venta_data.get('asistencia', 0),
-        venta_data.get('repuestos', 0),
-        venta_data.get('terceros', 0),
-        venta_data.get('descuento', 0),
-        venta_data.get('total', 0),
-        venta_data.get('detalles'),
-        venta_data.get('archivo_comprobante'),
-        venta_data.get('campo_taller'),
-        venta_id
-    ))
-    
-    conn.commit()
-    conn.close()
+        params = _row_params(venta_data, VENTAS_INSERT_COLS, VENTAS_DEFAULTS) + (venta_id,)
+        try:
+            _execute(cursor, UPDATE_VENTA_SQL, params)
+        except ERRORES_INTEGRIDAD as e:
+            error = _error_comprobante_duplicado(e)
+            if error is None:
+                raise
+            raise error from e
+    
+        conn.commit()
+        _datos_modificados()
 
+@_escritura
 def delete_venta(venta_id):
     """Elimina una venta"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    # Obtener información de la venta para eliminar archivo adjunto si existe
-    _execute(cursor, "SELECT archivo_comprobante FROM ventas WHERE id = ?", (venta_id,))
-    row = cursor.fetchone()
+        if SOPORTA_RETURNING:
+            # Borrar y obtener el archivo adjunto en una sola sentencia
+            _execute(cursor, "DELETE FROM ventas WHERE id = ? RETURNING archivo_comprobante", (venta_id,))
+            row = cursor.fetchone()
+        else:
+            _execute(cursor, "SELECT archivo_comprobante FROM ventas WHERE id = ?", (venta_id,))
+            row = cursor.fetchone()
+            _execute(cursor, "DELETE FROM ventas WHERE id = ?", (venta_id,))
+        conn.commit()
+        _datos_modificados()
     
     archivo_value = None
     if row:
@@ -559,6 +1021,7 @@ def delete_venta(venta_id):
         else:
             archivo_value = row[0]
     
+    # Eliminar el archivo adjunto recién cuando el borrado quedó confirmado
     if archivo_value:
         archivo_path = Path(archivo_value)
         if archivo_path.exists():
@@ -566,342 +1029,260 @@ def delete_venta(venta_id):
                 archivo_path.unlink()
             except:
                 pass
-    
-    _execute(cursor, "DELETE FROM ventas WHERE id = ?", (venta_id,))
-    conn.commit()
-    conn.close()
 
+@_escritura
 def inferir_campo_taller_existentes():
     """Infiere campo_taller para registros SE existentes que no lo tengan"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    try:
-        # Verificar si la columna existe primero
-        if USE_POSTGRES:
-            check_query = """
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='ventas' AND column_name='campo_taller'
-            """
-        else:
-            check_query = """
-                SELECT name FROM pragma_table_info('ventas') WHERE name='campo_taller'
-            """
+        try:
+            # Verificar si la columna existe primero
+            if USE_POSTGRES:
+                check_query = """
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE table_name='ventas' AND column_name='campo_taller'
+                """
+            else:
+                check_query = """
+                    SELECT name FROM pragma_table_info('ventas') WHERE name='campo_taller'
+                """
         
-        cursor.execute(check_query)
-        col_exists = cursor.fetchone() is not None
+            cursor.execute(check_query)
+            col_exists = cursor.fetchone() is not None
         
-        if not col_exists:
-            # La columna no existe, no hay nada que inferir
-            conn.close()
-            return 0
+            if not col_exists:
+                # La columna no existe, no hay nada que inferir
+                return 0
         
-        # Obtener registros SE sin campo_taller usando _read_sql para compatibilidad
-        query = "SELECT id, asistencia FROM ventas WHERE tipo_re_se = 'SE' AND (campo_taller IS NULL OR campo_taller = '')"
-        df_registros = _read_sql(query, conn)
+            # Obtener registros SE sin campo_taller usando _read_sql para compatibilidad
+            query = "SELECT id, asistencia FROM ventas WHERE tipo_re_se = 'SE' AND (campo_taller IS NULL OR campo_taller = '')"
+            df_registros = _read_sql(query, conn)
         
-        actualizados = 0
-        for _, row in df_registros.iterrows():
-            venta_id = row['id']
-            asistencia = row.get('asistencia', 0) or 0
+            actualizados = 0
+            for _, row in df_registros.iterrows():
+                venta_id = row['id']
+                asistencia = row.get('asistencia', 0) or 0
             
-            # Si asistencia > 0 es Campo, sino Taller
-            campo_taller = "Campo" if asistencia > 0 else "Taller"
+                # Si asistencia > 0 es Campo, sino Taller
+                campo_taller = "Campo" if asistencia > 0 else "Taller"
             
-            update_query = "UPDATE ventas SET campo_taller = ? WHERE id = ?"
-            _execute(cursor, update_query, (campo_taller, venta_id))
-            actualizados += 1
+                update_query = "UPDATE ventas SET campo_taller = ? WHERE id = ?"
+                _execute(cursor, update_query, (campo_taller, venta_id))
+                actualizados += 1
         
-        conn.commit()
-        conn.close()
-        return actualizados
-    except Exception as e:
-        # Si hay algún error, cerrar la conexión y retornar 0
-        try:
-            conn.close()
-        except:
-            pass
-        # No lanzar el error, solo retornar 0 para que la app continúe
-        return 0
+            conn.commit()
+            _datos_modificados()
+            return actualizados
+        except Exception as e:
+            # No lanzar el error, solo retornar 0 para que la app continúe
+            return 0
 
-def get_gastos(fecha_inicio=None, fecha_fin=None):
-    """Obtiene todos los gastos, opcionalmente filtrados por fecha"""
-    conn = get_connection()
-    
-    query = "SELECT * FROM gastos WHERE 1=1"
-    params = []
-    
-    if fecha_inicio:
-        query += " AND fecha >= ?"
-        params.append(fecha_inicio)
-    
-    if fecha_fin:
-        query += " AND fecha <= ?"
-        params.append(fecha_fin)
-    
-    query += " ORDER BY fecha DESC, id DESC"
-    
-    df = _read_sql(query, conn, params)
-    if len(df):
-        df = _sanitize_dataframe(
-            df,
-            [
-                "total_pesos",
-                "total_usd",
-                "total_pct",
-                "total_pct_se",
-                "total_pct_re",
-                "pct_postventa",
-                "pct_servicios",
-                "pct_repuestos",
-            ],
+def get_gastos(fecha_inicio=None, fecha_fin=None, columns=None, chunksize=None, excluir_clasificaciones=None):
+    """
+    Obtiene todos los gastos, opcionalmente filtrados por fecha y limitando las columnas leídas.
+    Con `chunksize` devuelve un generador de DataFrames (ver iter_gastos) en lugar de uno solo.
+    `excluir_clasificaciones` descarta en la consulta los gastos con esas clasificaciones.
+    """
+    if chunksize:
+        return iter_gastos(
+            fecha_inicio, fecha_fin, chunksize=chunksize, columns=columns,
+            excluir_clasificaciones=excluir_clasificaciones,
         )
-    conn.close()
+    columns = tuple(columns) if columns else None
+    excluir_clasificaciones = tuple(excluir_clasificaciones) if excluir_clasificaciones else None
+    return _get_gastos_cacheado(
+        _fecha_clave(fecha_inicio), _fecha_clave(fecha_fin), columns, excluir_clasificaciones, _VERSION_DATOS
+    )
+
+@_cache_lecturas
+def _get_gastos_cacheado(fecha_inicio, fecha_fin, columns, excluir_clasificaciones, version):
+    return _concat_bloques(
+        iter_gastos(fecha_inicio, fecha_fin, columns=columns, excluir_clasificaciones=excluir_clasificaciones)
+    )
+
+def iter_gastos(fecha_inicio=None, fecha_fin=None, chunksize=READ_CHUNK_SIZE, columns=None, excluir_clasificaciones=None):
+    """Recorre los gastos en bloques de `chunksize` filas, sin cargar toda la tabla en memoria"""
+    filtro = None
+    if excluir_clasificaciones:
+        marcadores = ", ".join("?" for _ in excluir_clasificaciones)
+        # Los gastos sin clasificación se conservan (NOT IN solo no los devolvería)
+        filtro = f"(clasificacion IS NULL OR clasificacion NOT IN ({marcadores}))"
+    query, params = _query_por_fecha(
+        "gastos", columns, GASTOS_SELECT_COLS, fecha_inicio, fecha_fin,
+        filtro=filtro, filtro_params=excluir_clasificaciones or (),
+    )
+    yield from _iter_tabla(query, params, GASTOS_NUMERIC_COLS, chunksize)
+
+def list_recent_gastos(limit=50):
+    """Obtiene los gastos más recientes (vista previa), sin leer toda la tabla"""
+    with get_connection() as conn:
+        df = _read_sql("SELECT * FROM gastos ORDER BY fecha DESC, id DESC LIMIT ?", conn, [limit])
+        if len(df):
+            df = _sanitize_dataframe(df, GASTOS_NUMERIC_COLS)
     
     return df
 
+def list_recent_gasto_ids(limit=500):
+    """Obtiene los IDs de los gastos más recientes (para selectores)"""
+    with get_connection() as conn:
+        cursor = _cursor_por_nombre(conn)
+        _execute(cursor, "SELECT id FROM gastos ORDER BY fecha DESC, id DESC LIMIT ?", (limit,))
+        ids = [row["id"] for row in cursor.fetchall()]
+    
+    return ids
+
 
+@_escritura
 def delete_gastos_por_clasificacion(clasificaciones):
     """Elimina todos los gastos cuya clasificación coincida con la lista proporcionada."""
     if not clasificaciones:
         return 0
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    placeholders = ",".join("?" for _ in clasificaciones)
-    query = f"DELETE FROM gastos WHERE clasificacion IN ({placeholders})"
-    _execute(cursor, query, clasificaciones)
-    eliminados = cursor.rowcount
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ",".join("?" for _ in clasificaciones)
+        query = f"DELETE FROM gastos WHERE clasificacion IN ({placeholders})"
+        _execute(cursor, query, clasificaciones)
+        eliminados = cursor.rowcount
+        conn.commit()
+        _datos_modificados()
     return eliminados
 
-def get_gasto_by_id(gasto_id):
-    """Obtiene un gasto por su ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    _execute(cursor, "SELECT * FROM gastos WHERE id = ?", (gasto_id,))
-    row = cursor.fetchone()
-    conn.close()
+def get_gasto_by_id(gasto_id, fields=None):
+    """Obtiene un gasto por su ID; con `fields` lee solo esas columnas"""
+    columnas = _select_columnas(fields, GASTOS_SELECT_COLS)
+    with get_connection() as conn:
+        cursor = _cursor_por_nombre(conn)
+        _execute(cursor, f"SELECT {columnas} FROM gastos WHERE id = ?", (gasto_id,))
+        row = cursor.fetchone()
     
     if row:
         return dict(row)
     return None
 
+@_escritura
 def insert_gasto(gasto_data):
     """Inserta un nuevo gasto"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    insert_sql = """
-        INSERT INTO gastos (
-            mes, fecha, sucursal, area, pct_postventa, pct_servicios,
-            pct_repuestos, tipo, clasificacion, proveedor, total_pesos,
-            total_usd, total_pct, total_pct_se, total_pct_re, detalles
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """
-    params = (
-        gasto_data.get('mes'),
-        gasto_data.get('fecha'),
-        gasto_data.get('sucursal'),
-        gasto_data.get('area'),
-        gasto_data.get('pct_postventa', 0),
-        gasto_data.get('pct_servicios', 0),
-        gasto_data.get('pct_repuestos', 0),
-        gasto_data.get('tipo'),
-        gasto_data.get('clasificacion'),
-        gasto_data.get('proveedor'),
-        gasto_data.get('total_pesos'),
-        gasto_data.get('total_usd', 0),
-        gasto_data.get('total_pct', 0),
-        gasto_data.get('total_pct_se', 0),
-        gasto_data.get('total_pct_re', 0),
-        gasto_data.get('detalles')
-    )
-
-    if USE_POSTGRES:
-        insert_sql = insert_sql.replace("?)", "?) RETURNING id")
-        _execute(cursor, insert_sql, params)
-        gasto_id = cursor.fetchone()["id"]
-    else:
-        _execute(cursor, insert_sql, params)
-        gasto_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        gasto_id = _insert_returning_id(
+            cursor, INSERT_GASTO_SQL, _row_params(gasto_data, GASTOS_INSERT_COLS, GASTOS_DEFAULTS)
+        )
+        conn.commit()
+        _datos_modificados()
     
     return gasto_id
 
+@_escritura
 def update_gasto(gasto_id, gasto_data):
     """Actualiza un gasto existente"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    _execute(cursor, """
-        UPDATE gastos SET
-            mes = ?, fecha = ?, sucursal = ?, area = ?, pct_postventa = ?,
-            pct_servicios = ?, pct_repuestos = ?, tipo = ?, clasificacion = ?,
-            proveedor = ?, total_pesos = ?, total_usd = ?, total_pct = ?,
-            total_pct_se = ?, total_pct_re = ?, detalles = ?
-        WHERE id = ?
-    """, (
-        gasto_data.get('mes'),
-        gasto_data.get('fecha'),
-        gasto_data.get('sucursal'),
-        gasto_data.get('area'),
-        gasto_data.get('pct_postventa', 0),
-        gasto_data.get('pct_servicios', 0),
-        gasto_data.get('pct_repuestos', 0),
-        gasto_data.get('tipo'),
-        gasto_data.get('clasificacion'),
-        gasto_data.get('proveedor'),
-        gasto_data.get('total_pesos'),
-        gasto_data.get('total_usd', 0),
-        gasto_data.get('total_pct', 0),
-        gasto_data.get('total_pct_se', 0),
-        gasto_data.get('total_pct_re', 0),
-        gasto_data.get('detalles'),
-        gasto_id
-    ))
-    
-    conn.commit()
-    conn.close()
+        params = _row_params(gasto_data, GASTOS_INSERT_COLS, GASTOS_DEFAULTS) + (gasto_id,)
+        _execute(cursor, UPDATE_GASTO_SQL, params)
+    
+        conn.commit()
+        _datos_modificados()
 
+@_escritura
 def delete_gasto(gasto_id):
     """Elimina un gasto"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    _execute(cursor, "DELETE FROM gastos WHERE id = ?", (gasto_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        _execute(cursor, "DELETE FROM gastos WHERE id = ?", (gasto_id,))
+        conn.commit()
+        _datos_modificados()
 
 def get_plantillas_gastos(activas_only=False):
     """Obtiene todas las plantillas de gastos"""
-    conn = get_connection()
-    
-    query = "SELECT * FROM plantillas_gastos"
-    if activas_only:
-        query += " WHERE activa = 1"
-    query += " ORDER BY nombre"
+    return _get_plantillas_gastos_cacheado(activas_only, _VERSION_DATOS)
+
+@_cache_lecturas
+def _get_plantillas_gastos_cacheado(activas_only, version):
+    with get_connection() as conn:
+        query = f"SELECT {', '.join(PLANTILLAS_SELECT_COLS)} FROM plantillas_gastos"
+        if activas_only:
+            query += " WHERE activa = 1"
+        query += " ORDER BY nombre"
     
-    df = _read_sql(query, conn)
-    conn.close()
+        df = _read_sql(query, conn)
     
     return df
 
 def get_plantilla_gasto_by_id(plantilla_id):
     """Obtiene una plantilla de gasto por su ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    _execute(cursor, "SELECT * FROM plantillas_gastos WHERE id = ?", (plantilla_id,))
-    row = cursor.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cursor = _cursor_por_nombre(conn)
+        _execute(cursor, f"SELECT {', '.join(PLANTILLAS_SELECT_COLS)} FROM plantillas_gastos WHERE id = ?", (plantilla_id,))
+        row = cursor.fetchone()
     
     if row:
         return dict(row)
     return None
 
+@_escritura
 def insert_plantilla_gasto(plantilla_data):
     """Inserta una nueva plantilla de gasto"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    insert_sql = """
-        INSERT INTO plantillas_gastos (
-            nombre, descripcion, sucursal, area, pct_postventa, pct_servicios,
-            pct_repuestos, tipo, clasificacion, proveedor, detalles, activa
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """
-    params = (
-        plantilla_data.get('nombre'),
-        plantilla_data.get('descripcion'),
-        plantilla_data.get('sucursal'),
-        plantilla_data.get('area'),
-        plantilla_data.get('pct_postventa', 0),
-        plantilla_data.get('pct_servicios', 0),
-        plantilla_data.get('pct_repuestos', 0),
-        plantilla_data.get('tipo'),
-        plantilla_data.get('clasificacion'),
-        plantilla_data.get('proveedor'),
-        plantilla_data.get('detalles'),
-        plantilla_data.get('activa', 1)
-    )
-    
-    if USE_POSTGRES:
-        insert_sql = insert_sql.replace("?)", "?) RETURNING id")
-        _execute(cursor, insert_sql, params)
-        plantilla_id = cursor.fetchone()["id"]
-    else:
-        _execute(cursor, insert_sql, params)
-        plantilla_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        plantilla_id = _insert_returning_id(cursor, INSERT_PLANTILLA_SQL, _plantilla_params(plantilla_data))
+        conn.commit()
+        _datos_modificados()
     
     return plantilla_id
 
+@_escritura
 def update_plantilla_gasto(plantilla_id, plantilla_data):
     """Actualiza una plantilla de gasto existente"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    _execute(cursor, """
-        UPDATE plantillas_gastos SET
-            nombre = ?, descripcion = ?, sucursal = ?, area = ?,
-            pct_postventa = ?, pct_servicios = ?, pct_repuestos = ?,
-            tipo = ?, clasificacion = ?, proveedor = ?, detalles = ?,
-            activa = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    """, (
-        plantilla_data.get('nombre'),
-        plantilla_data.get('descripcion'),
-        plantilla_data.get('sucursal'),
-        plantilla_data.get('area'),
-        plantilla_data.get('pct_postventa', 0),
-        plantilla_data.get('pct_servicios', 0),
-        plantilla_data.get('pct_repuestos', 0),
-        plantilla_data.get('tipo'),
-        plantilla_data.get('clasificacion'),
-        plantilla_data.get('proveedor'),
-        plantilla_data.get('detalles'),
-        plantilla_data.get('activa', 1),
-        plantilla_id
-    ))
-    
-    conn.commit()
-    conn.close()
+        params = _plantilla_params(plantilla_data) + (plantilla_id,)
+        _execute(cursor, UPDATE_PLANTILLA_SQL, params)
+    
+        conn.commit()
+        _datos_modificados()
 
+@_escritura
 def delete_plantilla_gasto(plantilla_id):
     """Elimina una plantilla de gasto"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    _execute(cursor, "DELETE FROM plantillas_gastos WHERE id = ?", (plantilla_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        _execute(cursor, "DELETE FROM plantillas_gastos WHERE id = ?", (plantilla_id,))
+        conn.commit()
+        _datos_modificados()
+
+def _con_default(valores, default):
+    """Reemplaza los nulos de la Series por default (en dtype object, para JSON)"""
+    return valores.astype(object).where(valores.notna(), default)
 
 def exportar_plantillas_gastos():
     """Exporta todas las plantillas de gastos a un diccionario (para JSON)"""
     df = get_plantillas_gastos()
-    
-    # Convertir a lista de diccionarios, excluyendo columnas que no son necesarias
-    plantillas = []
-    for _, row in df.iterrows():
-        plantilla = {
-            'nombre': row.get('nombre', ''),
-            'descripcion': row.get('descripcion', '') if pd.notna(row.get('descripcion')) else '',
-            'sucursal': row.get('sucursal', '') if pd.notna(row.get('sucursal')) else None,
-            'area': row.get('area', '') if pd.notna(row.get('area')) else None,
-            'pct_postventa': float(row.get('pct_postventa', 0)) if pd.notna(row.get('pct_postventa')) else 0.0,
-            'pct_servicios': float(row.get('pct_servicios', 0)) if pd.notna(row.get('pct_servicios')) else 0.0,
-            'pct_repuestos': float(row.get('pct_repuestos', 0)) if pd.notna(row.get('pct_repuestos')) else 0.0,
-            'tipo': row.get('tipo', '') if pd.notna(row.get('tipo')) else None,
-            'clasificacion': row.get('clasificacion', '') if pd.notna(row.get('clasificacion')) else None,
-            'proveedor': row.get('proveedor', '') if pd.notna(row.get('proveedor')) else None,
-            'detalles': row.get('detalles', '') if pd.notna(row.get('detalles')) else None,
-            'activa': bool(row.get('activa', True)) if pd.notna(row.get('activa')) else True
-        }
-        plantillas.append(plantilla)
-    
-    return plantillas
+    if len(df) == 0:
+        return []
+    
+    # Conversión por columna completa en lugar de recorrer filas, excluyendo columnas que no son necesarias
+    plantillas = pd.DataFrame({
+        'nombre': _columna(df, 'nombre'),
+        'descripcion': _con_default(_columna(df, 'descripcion'), ''),
+        'sucursal': _con_default(_columna(df, 'sucursal'), None),
+        'area': _con_default(_columna(df, 'area'), None),
+        'pct_postventa': _columna(df, 'pct_postventa').astype(float).fillna(0.0),
+        'pct_servicios': _columna(df, 'pct_servicios').astype(float).fillna(0.0),
+        'pct_repuestos': _columna(df, 'pct_repuestos').astype(float).fillna(0.0),
+        'tipo': _con_default(_columna(df, 'tipo'), None),
+        'clasificacion': _con_default(_columna(df, 'clasificacion'), None),
+        'proveedor': _con_default(_columna(df, 'proveedor'), None),
+        'detalles': _con_default(_columna(df, 'detalles'), None),
+        'activa': _con_default(_columna(df, 'activa'), True).map(bool),
+    })
+    return plantillas.to_dict('records')
 
 def importar_plantillas_gastos(plantillas_data, sobrescribir=False):
     """
@@ -913,6 +1294,9 @@ def importar_plantillas_gastos(plantillas_data, sobrescribir=False):
     
     Returns:
         dict con 'importadas', 'actualizadas', 'omitidas', 'errores'
+    
+    Todo se guarda en una sola transacción; si falla, se reintenta plantilla por plantilla
+    para guardar las válidas e informar el error de cada una.
     """
     resultado = {
         'importadas': 0,
@@ -921,9 +1305,13 @@ def importar_plantillas_gastos(plantillas_data, sobrescribir=False):
         'errores': []
     }
     
-    df_existentes = get_plantillas_gastos()
-    nombres_existentes = set(df_existentes['nombre'].str.lower()) if len(df_existentes) > 0 else set()
+    # Nombres ya guardados, normalizados igual que la clave del índice único
+    with get_connection() as conn:
+        cursor = _cursor_por_nombre(conn)
+        cursor.execute("SELECT nombre_clave FROM plantillas_gastos")
+        existentes = {row["nombre_clave"] for row in cursor.fetchall()}
     
+    pendientes = []  # (clave en resultado, nombre, fila)
     for idx, plantilla_data in enumerate(plantillas_data):
         try:
             nombre = plantilla_data.get('nombre', '').strip()
@@ -931,86 +1319,196 @@ def importar_plantillas_gastos(plantillas_data, sobrescribir=False):
                 resultado['errores'].append(f"Plantilla {idx + 1}: Nombre vacío")
                 continue
             
-            nombre_lower = nombre.lower()
+            nombre_lower = _clave_nombre_plantilla(nombre)
             
             # Verificar si ya existe
-            if nombre_lower in nombres_existentes:
-                if sobrescribir:
-                    # Buscar la plantilla existente por nombre
-                    plantilla_existente = df_existentes[df_existentes['nombre'].str.lower() == nombre_lower]
-                    if len(plantilla_existente) > 0:
-                        plantilla_id = plantilla_existente.iloc[0]['id']
-                        update_plantilla_gasto(plantilla_id, plantilla_data)
-                        resultado['actualizadas'] += 1
-                    else:
-                        # Si no se encuentra, crear nueva
-                        insert_plantilla_gasto(plantilla_data)
-                        resultado['importadas'] += 1
-                        nombres_existentes.add(nombre_lower)
-                else:
+            if nombre_lower in existentes:
+                if not sobrescribir:
                     resultado['omitidas'] += 1
+                    continue
+                # El UPSERT resuelve por nombre_clave y conserva el nombre tal como está guardado
+                clave = 'actualizadas'
             else:
-                # Crear nueva plantilla
-                insert_plantilla_gasto(plantilla_data)
-                resultado['importadas'] += 1
-                nombres_existentes.add(nombre_lower)
+                existentes.add(nombre_lower)
+                clave = 'importadas'
+            fila = _plantilla_params(plantilla_data)
+            pendientes.append((clave, nombre, fila))
         except Exception as e:
             resultado['errores'].append(f"Plantilla '{plantilla_data.get('nombre', 'Sin nombre')}': {str(e)}")
     
+    upsert = partial(_upsert_plantillas_many, sobrescribir=sobrescribir)
+    try:
+        # Todas las altas y actualizaciones en una sola transacción
+        guardadas = _insert_many_en_transaccion(upsert, [fila for _, _, fila in pendientes])
+    except Exception:
+        # Alguna plantilla no se pudo guardar: de a una, para conservar las válidas
+        for clave, nombre, fila in pendientes:
+            try:
+                guardada = _insert_many_en_transaccion(upsert, [fila])
+            except Exception as e:
+                resultado['errores'].append(f"Plantilla '{nombre}': {str(e)}")
+                continue
+            resultado[clave if guardada else 'omitidas'] += 1
+    else:
+        for clave, _, _ in pendientes:
+            resultado[clave] += 1
+        if not sobrescribir:
+            # DO NOTHING no cuenta las que ya existían en la base y el chequeo previo no detectó
+            ya_existentes = len(pendientes) - guardadas
+            resultado['importadas'] -= ya_existentes
+            resultado['omitidas'] += ya_existentes
+    
     return resultado
 
-def _limpiar_valor_monetario(valor):
-    """Convierte valores monetarios en texto a float (ej: 'US $556,00' -> 556.0, '-US $700,00' -> -700.0)"""
-    if pd.isna(valor):
-        return 0.0
+def _mapa_columnas(columns):
+    """Índice nombre normalizado (casefold) -> columnas del DataFrame (se arma una sola vez por importación)"""
+    mapa = {}
+    for col in columns:
+        mapa.setdefault(str(col).casefold(), []).append(col)
+    return mapa
+
+def _columnas_candidatas(columns, mapa, posibles_nombres):
+    """
+    Columnas del DataFrame que coinciden con alguno de los nombres posibles,
+    en orden de búsqueda: primero coincidencia exacta, luego sin distinguir mayúsculas.
+    """
+    encontradas = [nombre for nombre in posibles_nombres if nombre in columns]
+    for nombre in posibles_nombres:
+        for col in mapa.get(nombre.casefold(), ()):
+            if col not in encontradas:
+                encontradas.append(col)
+    return encontradas
+
+def _columna(df, nombre):
+    """Devuelve la columna si existe o una Series vacía (todo NaN) alineada al DataFrame"""
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+def _coalesce_columnas(df, mapa, posibles_nombres):
+    """Por fila, el primer valor no nulo entre las columnas candidatas (NaN si no hay ninguno)"""
+    columnas = _columnas_candidatas(df.columns, mapa, posibles_nombres)
+    if not columnas:
+        return pd.Series(np.nan, index=df.index, dtype=object)
+    valores = df[columnas[0]]
+    for col in columnas[1:]:
+        valores = valores.where(valores.notna(), df[col])
+    return valores
+
+def _texto(valores, default=None, vacio_como_default=True):
+    """Equivalente vectorizado de str(valor).strip(); los nulos (y opcionalmente '') toman el default"""
+    texto = valores.astype(str).str.strip().to_numpy(dtype=object)
+    validos = valores.notna().to_numpy()
+    if vacio_como_default:
+        validos = validos & (texto != '')
+    return pd.Series(np.where(validos, texto, default), index=valores.index, dtype=object)
+
+def _a_float(valores, default=0.0):
+    """
+    Equivalente vectorizado de float(valor) con default para nulos.
+    Devuelve (valores, invalidos) donde invalidos marca celdas no convertibles.
+    """
+    numeros = pd.to_numeric(valores, errors='coerce')
+    invalidos = valores.notna() & numeros.isna()
+    return numeros.where(valores.notna(), default), invalidos
+
+def _limpiar_valores_monetarios(valores):
+    """Convierte valores monetarios en texto a float (ej: 'US $556,00' -> 556.0, '-US $700,00' -> -700.0) para una Series completa"""
+    # Columna completamente numérica (el caso habitual de Total): no hay nada que limpiar
+    if pd.api.types.is_numeric_dtype(valores):
+        return valores.astype('float64').fillna(0.0)
     
-    # Si ya es numérico, retornarlo
-    if isinstance(valor, (int, float)):
-        return float(valor)
+    # Celdas ya numéricas (o texto numérico simple) se convierten directamente
+    numeros = pd.to_numeric(valores, errors='coerce')
+    pendientes = numeros.isna() & valores.notna()
+    if not pendientes.any():
+        return numeros.fillna(0.0)
     
-    # Convertir a string y limpiar
-    valor_str = str(valor).strip()
+    texto = valores[pendientes].astype(str).str.strip()
     
     # Detectar y preservar signo negativo
-    es_negativo = valor_str.startswith('-') or valor_str.startswith('(')
-    if es_negativo:
-        valor_str = valor_str.lstrip('-(').rstrip(')')
+    es_negativo = texto.str.match(_SIGNO_NEGATIVO_RE)
+    texto = texto.where(~es_negativo, texto.str.lstrip('-(').str.rstrip(')'))
     
     # Remover prefijos comunes (US $, $, etc.)
-    valor_str = re.sub(r'^[US\s\$]*', '', valor_str, flags=re.IGNORECASE)
-    
-    # Reemplazar comas por puntos (formato europeo: 556,00 -> 556.00)
-    # Si tiene punto y coma, la coma es decimal
-    if ',' in valor_str and '.' in valor_str:
-        # Formato: 1.234,56 -> quitar puntos (miles), reemplazar coma por punto
-        valor_str = valor_str.replace('.', '').replace(',', '.')
-    elif ',' in valor_str:
-        # Solo coma: puede ser decimal o miles
-        # Si hay más de 3 dígitos antes de la coma, probablemente es separador de miles
-        partes = valor_str.split(',')
-        if len(partes[0]) > 3:
-            valor_str = valor_str.replace(',', '')
-        else:
-            valor_str = valor_str.replace(',', '.')
+    texto = texto.str.replace(_PREFIX_RE, '', regex=True)
+    
+    # Formato europeo (1.234,56) o coma sola (decimal, o miles si hay más de 3 dígitos antes)
+    tiene_coma = texto.str.contains(',', regex=False)
+    tiene_punto = texto.str.contains('.', regex=False)
+    ambos = tiene_coma & tiene_punto
+    solo_coma = tiene_coma & ~tiene_punto
+    coma_miles = solo_coma & (texto.str.find(',') > 3)
+    texto = texto.where(~ambos, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    texto = texto.where(~coma_miles, texto.str.replace(',', '', regex=False))
+    texto = texto.where(~(solo_coma & ~coma_miles), texto.str.replace(',', '.', regex=False))
+    
+    limpios = pd.to_numeric(texto.str.strip(), errors='coerce').fillna(0.0)
+    numeros[pendientes] = np.where(es_negativo, -limpios, limpios)
+    return numeros.fillna(0.0)
+
+def _filas_para_insertar(df, columns):
+    """Convierte el DataFrame en tuplas (en el orden de columns) con None en lugar de NaN"""
+    columnas = []
+    for col in columns:
+        if col not in df.columns:
+            columnas.append([None] * len(df))
+            continue
+        serie = df[col]
+        columnas.append(np.where(serie.notna(), serie.astype(object), None).tolist())
+    return list(zip(*columnas))
+
+def _registrar_errores(errores, df, invalidos, motivo, valores):
+    """Agrega un error por fila inválida, con el valor de la celda para poder ubicarla"""
+    for idx in df.index[invalidos.to_numpy()]:
+        errores.append(f"Fila {idx + 2}: {motivo}: {valores[idx]!r}")
+
+def _es_nota_credito(tipo_comprobante):
+    """Notas de crédito (pero NO JD): su total se guarda en negativo"""
+    tipo = tipo_comprobante.astype(object)
+    return (
+        tipo.str.contains('CREDITO', case=False, regex=False, na=False)
+        & ~tipo.str.contains('JD', case=False, regex=False, na=False)
+    )
+
+def _normalizar_tipo_re_se(valores):
+    """RE o SE; cualquier otro valor (o vacío) se toma como SE"""
+    tipo = valores.astype(str).str.strip().str.upper()
+    return tipo.where(valores.notna() & tipo.isin(['RE', 'SE']), 'SE').astype(object)
+
+def _leer_fechas(df, errores):
+    """
+    Busca la columna de fecha y filtra las filas sin fecha válida.
+    Devuelve (df filtrado, fechas como datetime64) o (None, None) si no hay columna de fecha.
+    """
+    fecha_col = next((col for col in df.columns if 'fecha' in str(col).lower()), None)
+    if fecha_col is None:
+        return None, None
     
-    # Limpiar espacios y convertir
-    valor_str = valor_str.strip()
-    try:
-        resultado = float(valor_str) if valor_str else 0.0
-        # Aplicar signo negativo si estaba presente
-        return -resultado if es_negativo else resultado
-    except:
-        return 0.0
+    fechas = pd.to_datetime(df[fecha_col], errors='coerce', format='mixed')
+    _registrar_errores(errores, df, df[fecha_col].notna() & fechas.isna(), "fecha inválida", df[fecha_col])
+    validas = fechas.notna()
+    return df[validas], fechas[validas]
+
+def _formatear_por_mes(fechas, formato):
+    """
+    Equivalente a fechas.dt.strftime(formato) para formatos que solo dependen del mes y el año:
+    formatea una vez por mes distinto en lugar de una vez por fila. Las fechas no pueden tener NaT.
+    """
+    codigos, meses = pd.factorize(fechas.dt.to_period('M'))
+    return pd.Series(meses.strftime(formato).take(codigos), index=fechas.index)
+
+def _leer_hoja_excel(excel_path, hoja):
+    """Abre el libro una sola vez, verifica que la hoja exista y la lee"""
+    with pd.ExcelFile(excel_path) as excel_file:
+        if hoja not in excel_file.sheet_names:
+            raise ValueError(f"La hoja '{hoja}' no existe. Hojas disponibles: {excel_file.sheet_names}")
+        return excel_file.parse(hoja)
 
 def import_ventas_from_excel(excel_path):
     """Importa ventas desde un archivo Excel"""
     try:
-        # Verificar que la hoja existe
-        excel_file = pd.ExcelFile(excel_path)
-        if "REGISTRO VENTAS" not in excel_file.sheet_names:
-            raise ValueError(f"La hoja 'REGISTRO VENTAS' no existe. Hojas disponibles: {excel_file.sheet_names}")
-        
-        df = pd.read_excel(excel_path, sheet_name="REGISTRO VENTAS")
+        df = _leer_hoja_excel(excel_path, "REGISTRO VENTAS")
         
         if len(df) == 0:
             return 0
@@ -1021,137 +1519,79 @@ def import_ventas_from_excel(excel_path):
         # Detectar si el Excel tiene formato de exportación (nombres de columnas de BD)
         es_formato_exportacion = 'tipo_re_se' in df.columns or 'total' in df.columns
         
-        count = 0
         errores = []
-        for idx, row in df.iterrows():
-            try:
-                # Convertir fecha - buscar columna de fecha (puede tener diferentes nombres)
-                fecha_col = None
-                for col in df.columns:
-                    if 'fecha' in col.lower():
-                        fecha_col = col
-                        break
-                
-                if fecha_col is None or pd.isna(row.get(fecha_col)):
-                    continue
-                
-                fecha = pd.to_datetime(row[fecha_col]).date()
-                
-                # Buscar columnas por nombre flexible (case-insensitive)
-                def get_col_value(df, row, posibles_nombres, default=None):
-                    # Primero buscar coincidencia exacta
-                    for nombre in posibles_nombres:
-                        if nombre in df.columns:
-                            val = row.get(nombre)
-                            if pd.notna(val):
-                                return val
-                    # Si no encuentra, buscar case-insensitive
-                    for nombre in posibles_nombres:
-                        for col in df.columns:
-                            if col.upper() == nombre.upper():
-                                val = row.get(col)
-                                if pd.notna(val):
-                                    return val
-                    return default
-                
-                # Si es formato de exportación, usar valores directamente
-                if es_formato_exportacion:
-                    mes_val = row.get('mes', '')
-                    if pd.notna(mes_val) and mes_val:
-                        mes = str(mes_val)
-                    else:
-                        mes = fecha.strftime("%B%y")
-                    
-                    tipo_comprobante = str(row.get('tipo_comprobante', 'FACTURA VENTA')).strip() if pd.notna(row.get('tipo_comprobante')) else 'FACTURA VENTA'
-                    total = float(row.get('total', 0)) if pd.notna(row.get('total')) else 0
-                    
-                    # Si es nota de crédito (pero NO JD), convertir el total a negativo automáticamente
-                    es_nota_credito = tipo_comprobante and 'CREDITO' in tipo_comprobante.upper() and 'JD' not in tipo_comprobante.upper()
-                    if es_nota_credito and total > 0:
-                        total = -total
-                    
-                    tipo_re_se = str(row.get('tipo_re_se', 'SE')).strip().upper() if pd.notna(row.get('tipo_re_se')) else 'SE'
-                    # Validar que sea RE o SE
-                    if tipo_re_se not in ['RE', 'SE']:
-                        tipo_re_se = 'SE'  # Por defecto SE si no es válido
-                    
-                    venta_data = {
-                        'mes': mes,
-                        'fecha': fecha,
-                        'sucursal': str(row.get('sucursal', '')).strip() if pd.notna(row.get('sucursal')) else None,
-                        'cliente': str(row.get('cliente', '')).strip() if pd.notna(row.get('cliente')) else None,
-                        'pin': str(row.get('pin', '')).strip() if pd.notna(row.get('pin')) else None,
-                        'comprobante': str(row.get('comprobante', '')).strip() if pd.notna(row.get('comprobante')) else None,
-                        'tipo_comprobante': tipo_comprobante,
-                        'trabajo': str(row.get('trabajo', 'EXTERNO')).strip() if pd.notna(row.get('trabajo')) else 'EXTERNO',
-                        'n_comprobante': str(row.get('n_comprobante', '')).strip() if pd.notna(row.get('n_comprobante')) else None,
-                        'tipo_re_se': tipo_re_se,
-                        'mano_obra': float(row.get('mano_obra', 0)) if pd.notna(row.get('mano_obra')) else 0,
-                        'asistencia': float(row.get('asistencia', 0)) if pd.notna(row.get('asistencia')) else 0,
-                        'repuestos': float(row.get('repuestos', 0)) if pd.notna(row.get('repuestos')) else 0,
-                        'terceros': float(row.get('terceros', 0)) if pd.notna(row.get('terceros')) else 0,
-                        'descuento': float(row.get('descuento', 0)) if pd.notna(row.get('descuento')) else 0,
-                        'total': total,
-                        'detalles': str(row.get('detalles', '')).strip() if pd.notna(row.get('detalles')) else None
-                    }
-                else:
-                    # Formato original: buscar columnas con nombres descriptivos
-                    tipo_comprobante = str(get_col_value(df, row, ['Tipo Comprobante', 'TIPO COMPROBANTE'], 'FACTURA VENTA')).strip() or 'FACTURA VENTA'
-                    total = _limpiar_valor_monetario(get_col_value(df, row, ['Total', 'TOTAL'], 0))
-                    
-                    # Si es nota de crédito (pero NO JD), convertir el total a negativo automáticamente
-                    es_nota_credito = tipo_comprobante and 'CREDITO' in tipo_comprobante.upper() and 'JD' not in tipo_comprobante.upper()
-                    if es_nota_credito and total > 0:
-                        total = -total
-                    
-                    tipo_re_se_val = get_col_value(df, row, ['Tipo (RE o SE)', 'TIPO (RE o SE)', 'Tipo RE o SE'], 'SE')
-                    tipo_re_se = str(tipo_re_se_val).strip().upper() if tipo_re_se_val else 'SE'
-                    # Validar que sea RE o SE
-                    if tipo_re_se not in ['RE', 'SE']:
-                        tipo_re_se = 'SE'  # Por defecto SE si no es válido
-                    
-                    venta_data = {
-                        'mes': fecha.strftime("%B%y"),
-                        'fecha': fecha,
-                        'sucursal': str(get_col_value(df, row, ['Sucursal', 'SUCURSAL'], '')).strip() or None,
-                        'cliente': str(get_col_value(df, row, ['Cliente', 'CLIENTE'], '')).strip() or None,
-                        'pin': str(get_col_value(df, row, ['PIN'], '')).strip() or None,
-                        'comprobante': str(get_col_value(df, row, ['Comprobante', 'COMPROBANTE'], '')).strip() or None,
-                        'tipo_comprobante': tipo_comprobante,
-                        'trabajo': str(get_col_value(df, row, ['Trabajo', 'TRABAJO'], 'EXTERNO')).strip() or 'EXTERNO',
-                        'n_comprobante': str(get_col_value(df, row, ['N° Comprobante', "N' Comprobante", 'N COMPROBANTE', 'N Comprobante'], '')).strip() or None,
-                        'tipo_re_se': tipo_re_se,
-                        'mano_obra': _limpiar_valor_monetario(get_col_value(df, row, ['Mano de Obra', 'MANO DE OBRA'], 0)),
-                        'asistencia': _limpiar_valor_monetario(get_col_value(df, row, ['Asistencia', 'ASISTENCIA'], 0)),
-                        'repuestos': _limpiar_valor_monetario(get_col_value(df, row, ['Repuestos', 'REPUESTOS'], 0)),
-                        'terceros': _limpiar_valor_monetario(get_col_value(df, row, ['Terceros', 'TERCEROS'], 0)),
-                        'descuento': _limpiar_valor_monetario(get_col_value(df, row, ['Descuento', 'DESCUENTO'], 0)),
-                        'total': total,
-                        'detalles': str(get_col_value(df, row, ['Detalles', 'DETALLES'], '')).strip() or None
-                    }
-                
-                insert_venta(venta_data)
-                count += 1
-            except Exception as e:
-                errores.append(f"Fila {idx + 2}: {str(e)}")
-                continue
+        df, fechas = _leer_fechas(df, errores)
+        if df is None or len(df) == 0:
+            return 0
+        
+        # Todas las transformaciones se aplican por columna completa (sin recorrer filas)
+        ventas = pd.DataFrame(index=df.index)
+        ventas['fecha'] = fechas.dt.date
+        mes_calculado = _formatear_por_mes(fechas, "%B%y")
+        
+        if es_formato_exportacion:
+            # Si es formato de exportación, usar valores directamente
+            mes_val = _columna(df, 'mes')
+            usar_mes = mes_val.notna() & mes_val.astype(bool)
+            ventas['mes'] = mes_calculado.where(~usar_mes, mes_val.astype(str))
+            
+            ventas['tipo_comprobante'] = _texto(_columna(df, 'tipo_comprobante'), 'FACTURA VENTA', vacio_como_default=False)
+            for campo in ['sucursal', 'cliente', 'pin', 'comprobante', 'n_comprobante', 'detalles']:
+                ventas[campo] = _texto(_columna(df, campo), vacio_como_default=False)
+            ventas['trabajo'] = _texto(_columna(df, 'trabajo'), 'EXTERNO', vacio_como_default=False)
+            ventas['tipo_re_se'] = _normalizar_tipo_re_se(_columna(df, 'tipo_re_se'))
+            
+            invalidos = pd.Series(False, index=df.index)
+            for campo in ['mano_obra', 'asistencia', 'repuestos', 'terceros', 'descuento', 'total']:
+                valores = _columna(df, campo)
+                ventas[campo], invalidos_campo = _a_float(valores)
+                _registrar_errores(errores, df, invalidos_campo, f"valor numérico inválido en '{campo}'", valores)
+                invalidos |= invalidos_campo
+            ventas = ventas[~invalidos]
+        else:
+            # Formato original: buscar columnas con nombres descriptivos
+            mapa = _mapa_columnas(df.columns)
+            ventas['tipo_comprobante'] = _texto(
+                _coalesce_columnas(df, mapa, ['Tipo Comprobante', 'TIPO COMPROBANTE']), 'FACTURA VENTA'
+            )
+            ventas['total'] = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['Total', 'TOTAL']))
+            ventas['tipo_re_se'] = _normalizar_tipo_re_se(
+                _coalesce_columnas(df, mapa, ['Tipo (RE o SE)', 'TIPO (RE o SE)', 'Tipo RE o SE'])
+            )
+            ventas['mes'] = mes_calculado
+            ventas['sucursal'] = _texto(_coalesce_columnas(df, mapa, ['Sucursal', 'SUCURSAL']))
+            ventas['cliente'] = _texto(_coalesce_columnas(df, mapa, ['Cliente', 'CLIENTE']))
+            ventas['pin'] = _texto(_coalesce_columnas(df, mapa, ['PIN']))
+            ventas['comprobante'] = _texto(_coalesce_columnas(df, mapa, ['Comprobante', 'COMPROBANTE']))
+            ventas['trabajo'] = _texto(_coalesce_columnas(df, mapa, ['Trabajo', 'TRABAJO']), 'EXTERNO')
+            ventas['n_comprobante'] = _texto(
+                _coalesce_columnas(df, mapa, ['N° Comprobante', "N' Comprobante", 'N COMPROBANTE', 'N Comprobante'])
+            )
+            ventas['mano_obra'] = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['Mano de Obra', 'MANO DE OBRA']))
+            ventas['asistencia'] = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['Asistencia', 'ASISTENCIA']))
+            ventas['repuestos'] = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['Repuestos', 'REPUESTOS']))
+            ventas['terceros'] = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['Terceros', 'TERCEROS']))
+            ventas['descuento'] = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['Descuento', 'DESCUENTO']))
+            ventas['detalles'] = _texto(_coalesce_columnas(df, mapa, ['Detalles', 'DETALLES']))
+        
+        # Si es nota de crédito (pero NO JD), convertir el total a negativo automáticamente
+        es_nota_credito = _es_nota_credito(ventas['tipo_comprobante']) & (ventas['total'] > 0)
+        ventas.loc[es_nota_credito, 'total'] = -ventas.loc[es_nota_credito, 'total']
         
         if errores:
             print(f"Errores durante la importación: {errores[:5]}")  # Mostrar solo los primeros 5
         
-        return count
+        filas = _filas_para_insertar(ventas, VENTAS_INSERT_COLS)
+        importados = _insert_many_en_transaccion(_insert_ventas_many, filas)
+        _actualizar_estadisticas("ventas", importados)
+        return importados
     except Exception as e:
         raise Exception(f"Error al importar ventas: {str(e)}")
 
 def import_gastos_from_excel(excel_path):
     """Importa gastos desde un archivo Excel"""
     try:
-        # Verificar que la hoja existe
-        excel_file = pd.ExcelFile(excel_path)
-        if "REGISTRO GASTOS" not in excel_file.sheet_names:
-            raise ValueError(f"La hoja 'REGISTRO GASTOS' no existe. Hojas disponibles: {excel_file.sheet_names}")
-        
-        df = pd.read_excel(excel_path, sheet_name="REGISTRO GASTOS")
+        df = _leer_hoja_excel(excel_path, "REGISTRO GASTOS")
         
         if len(df) == 0:
             return 0
@@ -1162,133 +1602,91 @@ def import_gastos_from_excel(excel_path):
         # Detectar si el Excel tiene formato de exportación (nombres de columnas de BD)
         es_formato_exportacion = 'total_usd' in df.columns or 'total_pct_se' in df.columns
         
-        # Buscar columnas por nombre flexible (case-insensitive)
-        def get_col_value(df, row, posibles_nombres, default=None):
-            # Primero buscar coincidencia exacta
-            for nombre in posibles_nombres:
-                if nombre in df.columns:
-                    val = row.get(nombre)
-                    if pd.notna(val):
-                        return val
-            # Si no encuentra, buscar case-insensitive
-            for nombre in posibles_nombres:
-                for col in df.columns:
-                    if col.upper() == nombre.upper():
-                        val = row.get(col)
-                        if pd.notna(val):
-                            return val
-            return default
-        
-        count = 0
         errores = []
-        for idx, row in df.iterrows():
-            try:
-                # Convertir fecha - buscar columna de fecha
-                fecha_col = None
-                for col in df.columns:
-                    if 'fecha' in col.lower():
-                        fecha_col = col
-                        break
-                
-                if fecha_col is None or pd.isna(row.get(fecha_col)):
-                    continue
-                
-                fecha = pd.to_datetime(row[fecha_col]).date()
-                
-                # Si es formato de exportación (nombres de columnas de BD), usar directamente
-                if es_formato_exportacion:
-                    total_usd = float(row.get('total_usd', 0)) if pd.notna(row.get('total_usd')) else 0
-                    total_pct_se = float(row.get('total_pct_se', 0)) if pd.notna(row.get('total_pct_se')) else 0
-                    total_pct_re = float(row.get('total_pct_re', 0)) if pd.notna(row.get('total_pct_re')) else 0
-                    total_pct = float(row.get('total_pct', 0)) if pd.notna(row.get('total_pct')) else (total_pct_se + total_pct_re)
-                    pct_postventa = float(row.get('pct_postventa', 0)) if pd.notna(row.get('pct_postventa')) else 0
-                    pct_servicios = float(row.get('pct_servicios', 0)) if pd.notna(row.get('pct_servicios')) else 0
-                    pct_repuestos = float(row.get('pct_repuestos', 0)) if pd.notna(row.get('pct_repuestos')) else 0
-                else:
-                    # Formato original: buscar Total USD (puede venir como texto "US $20,87")
-                    total_usd_val = get_col_value(df, row, ['Total USD', 'TOTAL USD', 'Total US$'], 0)
-                    total_usd = _limpiar_valor_monetario(total_usd_val)
-                    
-                    # Buscar porcentajes (pueden venir sin espacio: %POSTVENTA)
-                    pct_postventa = _limpiar_valor_monetario(get_col_value(df, row, ['% Postventa', '%POSTVENTA', '% POSTVENTA'], 0))
-                    pct_servicios = _limpiar_valor_monetario(get_col_value(df, row, ['% Servicios', '%SERVICIOS', '% SERVICIOS'], 0))
-                    pct_repuestos = _limpiar_valor_monetario(get_col_value(df, row, ['% Repuestos', '%REPUESTOS', '% REPUESTOS'], 0))
-                    
-                    total_pct = total_usd * (pct_postventa / 100) if pct_postventa > 0 else 0
-                    total_pct_se = total_pct * (pct_servicios / 100) if pct_servicios > 0 else 0
-                    total_pct_re = total_pct * (pct_repuestos / 100) if pct_repuestos > 0 else 0
-                    
-                    # Si hay valores en TOTAL %SE y TOTAL %RE, usarlos directamente
-                    total_pct_se_val = get_col_value(df, row, ['TOTAL %SE', 'Total %SE', 'TOTAL % SE'], None)
-                    total_pct_re_val = get_col_value(df, row, ['TOTAL %RE', 'Total %RE', 'TOTAL % RE'], None)
-                    
-                    if total_pct_se_val is not None:
-                        total_pct_se = _limpiar_valor_monetario(total_pct_se_val)
-                    if total_pct_re_val is not None:
-                        total_pct_re = _limpiar_valor_monetario(total_pct_re_val)
-                
-                if total_usd == 0 and total_pct_se == 0 and total_pct_re == 0:
-                    continue  # Saltar si no hay valores
-                
-                # Obtener otros campos según el formato
-                if es_formato_exportacion:
-                    mes_val = row.get('mes', '')
-                    if pd.notna(mes_val) and mes_val:
-                        mes = str(mes_val)
-                    else:
-                        mes = fecha.strftime("%B%y")
-                    
-                    gasto_data = {
-                        'mes': mes,
-                        'fecha': fecha,
-                        'sucursal': str(row.get('sucursal', '')).strip() if pd.notna(row.get('sucursal')) else None,
-                        'area': str(row.get('area', '')).strip() if pd.notna(row.get('area')) else None,
-                        'pct_postventa': pct_postventa,
-                        'pct_servicios': pct_servicios,
-                        'pct_repuestos': pct_repuestos,
-                        'tipo': str(row.get('tipo', '')).strip() if pd.notna(row.get('tipo')) else None,
-                        'clasificacion': str(row.get('clasificacion', '')).strip() if pd.notna(row.get('clasificacion')) else None,
-                        'proveedor': str(row.get('proveedor', '')).strip() if pd.notna(row.get('proveedor')) else None,
-                        'total_pesos': float(row.get('total_pesos', 0)) if pd.notna(row.get('total_pesos')) else None,
-                        'total_usd': total_usd,
-                        'total_pct': total_pct,
-                        'total_pct_se': total_pct_se,
-                        'total_pct_re': total_pct_re,
-                        'detalles': str(row.get('detalles', '')).strip() if pd.notna(row.get('detalles')) else None
-                    }
-                else:
-                    gasto_data = {
-                        'mes': fecha.strftime("%B%y"),
-                        'fecha': fecha,
-                        'sucursal': str(get_col_value(df, row, ['Sucursal', 'SUCURSAL'], '')).strip() or None,
-                        'area': str(get_col_value(df, row, ['Area', 'Área', 'AREA'], '')).strip() or None,
-                        'pct_postventa': pct_postventa,
-                        'pct_servicios': pct_servicios,
-                        'pct_repuestos': pct_repuestos,
-                        'tipo': str(get_col_value(df, row, ['Tipo', 'TIPO'], '')).strip() or None,
-                        'clasificacion': str(get_col_value(df, row, ['Clasificación', 'Clasificacion', 'CLASIFICACION', 'CLASIFICACIÓN'], '')).strip() or None,
-                        'proveedor': str(get_col_value(df, row, ['Proveedor', 'PROVEEDOR'], '')).strip() or None,
-                        'total_pesos': _limpiar_valor_monetario(get_col_value(df, row, ['Total Pesos', 'TOTAL PESOS'], 0)) or None,
-                        'total_usd': total_usd,
-                        'total_pct': total_pct,
-                        'total_pct_se': total_pct_se,
-                        'total_pct_re': total_pct_re,
-                        'detalles': str(get_col_value(df, row, ['Detalles', 'DETALLES'], '')).strip() or None
-                    }
-                
-                insert_gasto(gasto_data)
-                count += 1
-            except Exception as e:
-                errores.append(f"Fila {idx + 2}: {str(e)}")
-                continue
+        df, fechas = _leer_fechas(df, errores)
+        if df is None or len(df) == 0:
+            return 0
+        
+        # Todas las transformaciones se aplican por columna completa (sin recorrer filas)
+        gastos = pd.DataFrame(index=df.index)
+        gastos['fecha'] = fechas.dt.date
+        mes_calculado = _formatear_por_mes(fechas, "%B%y")
+        
+        if es_formato_exportacion:
+            # Si es formato de exportación (nombres de columnas de BD), usar directamente
+            invalidos = pd.Series(False, index=df.index)
+            campos_numericos = [
+                ('total_usd', 0.0), ('total_pct_se', 0.0), ('total_pct_re', 0.0), ('pct_postventa', 0.0),
+                ('pct_servicios', 0.0), ('pct_repuestos', 0.0), ('total_pct', np.nan), ('total_pesos', np.nan),
+            ]
+            for campo, default in campos_numericos:
+                valores = _columna(df, campo)
+                gastos[campo], invalidos_campo = _a_float(valores, default=default)
+                _registrar_errores(errores, df, invalidos_campo, f"valor numérico inválido en '{campo}'", valores)
+                invalidos |= invalidos_campo
+            gastos['total_pct'] = gastos['total_pct'].fillna(gastos['total_pct_se'] + gastos['total_pct_re'])
+            
+            mes_val = _columna(df, 'mes')
+            usar_mes = mes_val.notna() & mes_val.astype(bool)
+            gastos['mes'] = mes_calculado.where(~usar_mes, mes_val.astype(str))
+            for campo in ['sucursal', 'area', 'tipo', 'clasificacion', 'proveedor', 'detalles']:
+                gastos[campo] = _texto(_columna(df, campo), vacio_como_default=False)
+            gastos = gastos[~invalidos]
+        else:
+            # Formato original: buscar Total USD (puede venir como texto "US $20,87")
+            mapa = _mapa_columnas(df.columns)
+            total_usd = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['Total USD', 'TOTAL USD', 'Total US$']))
+            
+            # Buscar porcentajes (pueden venir sin espacio: %POSTVENTA)
+            pct_postventa = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['% Postventa', '%POSTVENTA', '% POSTVENTA']))
+            pct_servicios = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['% Servicios', '%SERVICIOS', '% SERVICIOS']))
+            pct_repuestos = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['% Repuestos', '%REPUESTOS', '% REPUESTOS']))
+            
+            total_pct = (total_usd * (pct_postventa / 100)).where(pct_postventa > 0, 0.0)
+            total_pct_se = (total_pct * (pct_servicios / 100)).where(pct_servicios > 0, 0.0)
+            total_pct_re = (total_pct * (pct_repuestos / 100)).where(pct_repuestos > 0, 0.0)
+            
+            # Si hay valores en TOTAL %SE y TOTAL %RE, usarlos directamente
+            total_pct_se_val = _coalesce_columnas(df, mapa, ['TOTAL %SE', 'Total %SE', 'TOTAL % SE'])
+            total_pct_re_val = _coalesce_columnas(df, mapa, ['TOTAL %RE', 'Total %RE', 'TOTAL % RE'])
+            total_pct_se = total_pct_se.where(total_pct_se_val.isna(), _limpiar_valores_monetarios(total_pct_se_val))
+            total_pct_re = total_pct_re.where(total_pct_re_val.isna(), _limpiar_valores_monetarios(total_pct_re_val))
+            
+            total_pesos = _limpiar_valores_monetarios(_coalesce_columnas(df, mapa, ['Total Pesos', 'TOTAL PESOS']))
+            
+            gastos['mes'] = mes_calculado
+            gastos['sucursal'] = _texto(_coalesce_columnas(df, mapa, ['Sucursal', 'SUCURSAL']))
+            gastos['area'] = _texto(_coalesce_columnas(df, mapa, ['Area', 'Área', 'AREA']))
+            gastos['pct_postventa'] = pct_postventa
+            gastos['pct_servicios'] = pct_servicios
+            gastos['pct_repuestos'] = pct_repuestos
+            gastos['tipo'] = _texto(_coalesce_columnas(df, mapa, ['Tipo', 'TIPO']))
+            gastos['clasificacion'] = _texto(
+                _coalesce_columnas(df, mapa, ['Clasificación', 'Clasificacion', 'CLASIFICACION', 'CLASIFICACIÓN'])
+            )
+            gastos['proveedor'] = _texto(_coalesce_columnas(df, mapa, ['Proveedor', 'PROVEEDOR']))
+            gastos['total_pesos'] = total_pesos.where(total_pesos != 0)
+            gastos['total_usd'] = total_usd
+            gastos['total_pct'] = total_pct
+            gastos['total_pct_se'] = total_pct_se
+            gastos['total_pct_re'] = total_pct_re
+            gastos['detalles'] = _texto(_coalesce_columnas(df, mapa, ['Detalles', 'DETALLES']))
+        
+        # Saltar filas sin valores
+        sin_valores = (gastos['total_usd'] == 0) & (gastos['total_pct_se'] == 0) & (gastos['total_pct_re'] == 0)
+        gastos = gastos[~sin_valores]
         
         if errores:
             print(f"Errores durante la importación: {errores[:5]}")  # Mostrar solo los primeros 5
         
-        return count
+        filas = _filas_para_insertar(gastos, GASTOS_INSERT_COLS)
+        importados = _insert_many_en_transaccion(_insert_gastos_many, filas)
+        _actualizar_estadisticas("gastos", importados)
+        return importados
     except Exception as e:
         raise Exception(f"Error al importar gastos: {str(e)}")
 
+@_escritura
 def eliminar_todos_los_registros(eliminar_plantillas=False):
     """
     Elimina todos los registros de ventas y gastos de la base de datos.
@@ -1299,62 +1697,56 @@ def eliminar_todos_los_registros(eliminar_plantillas=False):
     Returns:
         dict: Diccionario con el conteo de registros eliminados
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    try:
-        # Contar registros antes de eliminar
-        _execute(cursor, "SELECT COUNT(*) FROM ventas")
-        count_ventas = _fetch_scalar(cursor, 0)
-        
-        _execute(cursor, "SELECT COUNT(*) FROM gastos")
-        count_gastos = _fetch_scalar(cursor, 0)
-        
-        count_plantillas = 0
-        if eliminar_plantillas:
-            _execute(cursor, "SELECT COUNT(*) FROM plantillas_gastos")
-            count_plantillas = _fetch_scalar(cursor, 0)
-        
-        # Eliminar registros
-        _execute(cursor, "DELETE FROM ventas")
-        _execute(cursor, "DELETE FROM gastos")
-        
-        if eliminar_plantillas:
-            _execute(cursor, "DELETE FROM plantillas_gastos")
-        
-        # Resetear los autoincrement IDs
-        if USE_POSTGRES:
+        try:
             tablas = ["ventas", "gastos"]
             if eliminar_plantillas:
                 tablas.append("plantillas_gastos")
-            for tabla in tablas:
+        
+            if USE_POSTGRES:
+                # TRUNCATE no recorre filas ni deja tuplas muertas; el LOCK previo deja los conteos exactos
+                _execute(cursor, f"LOCK TABLE {', '.join(tablas)} IN ACCESS EXCLUSIVE MODE")
+                conteos = ", ".join(f"(SELECT COUNT(*) FROM {tabla}) AS {tabla}" for tabla in tablas)
+                _execute(cursor, f"SELECT {conteos}")
+                fila = cursor.fetchone()
+                conteos = [fila[tabla] for tabla in tablas]
+                # RESTART IDENTITY reinicia los SERIAL (reemplaza los setval por tabla)
+                _execute(cursor, f"TRUNCATE {', '.join(tablas)} RESTART IDENTITY")
+            else:
+                # Tomar el lock de escritura desde el inicio: todo se confirma en un único commit
+                cursor.execute("BEGIN IMMEDIATE")
+                # DELETE sin WHERE usa la optimización de truncado de SQLite; rowcount da el conteo
+                conteos = []
+                for tabla in tablas:
+                    _execute(cursor, f"DELETE FROM {tabla}")
+                    conteos.append(cursor.rowcount)
+                # Resetear los autoincrement IDs
                 _execute(
                     cursor,
-                    f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), COALESCE((SELECT MAX(id) FROM {tabla}), 1), true)"
+                    "DELETE FROM sqlite_sequence WHERE name IN ('ventas', 'gastos', 'plantillas_gastos')"
                 )
-        else:
-            _execute(
-                cursor,
-                "DELETE FROM sqlite_sequence WHERE name IN ('ventas', 'gastos', 'plantillas_gastos')"
-            )
+            count_ventas, count_gastos = conteos[0], conteos[1]
+            count_plantillas = conteos[2] if eliminar_plantillas else 0
         
-        conn.commit()
+            conn.commit()
+            _datos_modificados()
         
-        return {
-            'ventas_eliminadas': count_ventas,
-            'gastos_eliminados': count_gastos,
-            'plantillas_eliminadas': count_plantillas if eliminar_plantillas else 0,
-            'exito': True
-        }
-    except Exception as e:
-        conn.rollback()
-        return {
-            'exito': False,
-            'error': str(e)
-        }
-    finally:
-        conn.close()
+            return {
+                'ventas_eliminadas': count_ventas,
+                'gastos_eliminados': count_gastos,
+                'plantillas_eliminadas': count_plantillas,
+                'exito': True
+            }
+        except Exception as e:
+            conn.rollback()
+            return {
+                'exito': False,
+                'error': str(e)
+            }
 
+@_escritura
 def guardar_analisis_ia(tipo_analisis: str, fuente: str, contenido: str, metadata: dict = None):
     """
     Guarda un análisis de IA en el historial.
@@ -1368,26 +1760,25 @@ def guardar_analisis_ia(tipo_analisis: str, fuente: str, contenido: str, metadat
     Returns:
         int: ID del registro guardado
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    metadata_json = json.dumps(metadata) if metadata else None
+        metadata_json = json.dumps(metadata) if metadata else None
     
-    insert_sql = """
-        INSERT INTO historial_analisis_ia (tipo_analisis, fuente, contenido, metadata)
-        VALUES (?, ?, ?, ?)
-    """
-    params = (tipo_analisis, fuente, contenido, metadata_json)
+        insert_sql = """
+            INSERT INTO historial_analisis_ia (tipo_analisis, fuente, contenido, metadata)
+            VALUES (?, ?, ?, ?)
+        """
+        params = (tipo_analisis, fuente, contenido, metadata_json)
 
-    if USE_POSTGRES:
-        insert_sql = insert_sql.replace("?)", "?) RETURNING id")
-        _execute(cursor, insert_sql, params)
-        registro_id = cursor.fetchone()["id"]
-    else:
-        _execute(cursor, insert_sql, params)
-        registro_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        if USE_POSTGRES:
+            insert_sql = insert_sql.replace("?)", "?) RETURNING id")
+            _execute(cursor, insert_sql, params)
+            registro_id = cursor.fetchone()["id"]
+        else:
+            _execute(cursor, insert_sql, params)
+            registro_id = cursor.lastrowid
+        conn.commit()
     
     return registro_id
 
@@ -1403,27 +1794,28 @@ def get_historial_analisis_ia(limit: int = 50, tipo_analisis: str = None, fuente
     Returns:
         pd.DataFrame: DataFrame con el historial
     """
-    conn = get_connection()
+    with get_connection() as conn:
+        query = "SELECT * FROM historial_analisis_ia WHERE 1=1"
+        params = []
     
-    query = "SELECT * FROM historial_analisis_ia WHERE 1=1"
-    params = []
-    
-    if tipo_analisis:
-        query += " AND tipo_analisis = ?"
-        params.append(tipo_analisis)
+        if tipo_analisis:
+            query += " AND tipo_analisis = ?"
+            params.append(tipo_analisis)
     
-    if fuente:
-        query += " AND fuente = ?"
-        params.append(fuente)
+        if fuente:
+            query += " AND fuente = ?"
+            params.append(fuente)
     
-    query += " ORDER BY fecha_hora DESC LIMIT ?"
-    params.append(limit)
+        query += " ORDER BY fecha_hora DESC LIMIT ?"
+        params.append(limit)
     
-    df = _read_sql(query, conn, params)
-    conn.close()
+        df = _read_sql(query, conn, params)
     
     return df
 
+# Tipos de análisis que el resumen mensual agrupa por contenido (los demás se listan completos)
+TIPOS_ANALISIS_AGRUPADOS = ('recomendacion', 'alerta')
+
 def get_resumen_mensual_analisis_ia(mes: int = None, año: int = None):
     """
     Obtiene un resumen mensual de los análisis de IA, agrupando por tipo y mostrando lo más relevante.
@@ -1442,30 +1834,30 @@ def get_resumen_mensual_analisis_ia(mes: int = None, año: int = None):
     if año is None:
         año = datetime.now().year
     
-    conn = get_connection()
-    
-    # Obtener todos los registros del mes
-    if USE_POSTGRES:
-        query = """
-            SELECT * FROM historial_analisis_ia 
-            WHERE EXTRACT(YEAR FROM fecha_hora) = %s 
-              AND EXTRACT(MONTH FROM fecha_hora) = %s
-            ORDER BY fecha_hora DESC
-        """
-        params = (año, mes)
-    else:
-        query = """
-            SELECT * FROM historial_analisis_ia 
-            WHERE strftime('%Y', fecha_hora) = ? 
-              AND strftime('%m', fecha_hora) = ?
+    # Rango [inicio del mes, inicio del mes siguiente): aprovecha idx_hia_fecha (strftime/EXTRACT no)
+    desde = f"{año:04d}-{mes:02d}-01"
+    hasta = f"{año + 1:04d}-01-01" if mes == 12 else f"{año:04d}-{mes + 1:02d}-01"
+    agrupados = ", ".join(f"'{tipo}'" for tipo in TIPOS_ANALISIS_AGRUPADOS)
+    
+    with get_connection() as conn:
+        # Tipos que se listan completos: solo las columnas que se muestran
+        df = _read_sql(f"""
+            SELECT tipo_analisis, contenido, fuente, fecha_hora FROM historial_analisis_ia
+            WHERE fecha_hora >= ? AND fecha_hora < ?
+              AND tipo_analisis NOT IN ({agrupados})
             ORDER BY fecha_hora DESC
-        """
-        params = (str(año), f"{mes:02d}")
-    
-    df = _read_sql(query, conn, params)
-    conn.close()
-    
-    if len(df) == 0:
+        """, conn, (desde, hasta))
+        # Recomendaciones y alertas: la base agrupa por contenido y fuente
+        df_agrupado = _read_sql(f"""
+            SELECT tipo_analisis, contenido, fuente, COUNT(*) AS frecuencia, MAX(fecha_hora) AS ultima_aparicion
+            FROM historial_analisis_ia
+            WHERE fecha_hora >= ? AND fecha_hora < ?
+              AND tipo_analisis IN ({agrupados})
+            GROUP BY tipo_analisis, contenido, fuente
+        """, conn, (desde, hasta))
+    
+    total_registros = len(df) + int(df_agrupado['frecuencia'].sum())
+    if total_registros == 0:
         return {
             'mes': mes,
             'año': año,
@@ -1475,42 +1867,51 @@ def get_resumen_mensual_analisis_ia(mes: int = None, año: int = None):
     
     # Convertir fecha_hora a datetime
     df['fecha_hora'] = pd.to_datetime(df['fecha_hora'])
+    df_agrupado['ultima_aparicion'] = pd.to_datetime(df_agrupado['ultima_aparicion'])
     
     resumen = {
         'mes': mes,
         'año': año,
-        'total_registros': len(df),
+        'total_registros': total_registros,
         'resumen': {}
     }
     
     # Agrupar por tipo de análisis
     for tipo in ['tendencia', 'prediccion', 'anomalia', 'recomendacion', 'alerta']:
-        df_tipo = df[df['tipo_analisis'] == tipo]
-        
-        if len(df_tipo) == 0:
-            continue
-        
         # Para recomendaciones y alertas, agrupar por contenido similar (usar los más frecuentes)
-        if tipo in ['recomendacion', 'alerta']:
-            # Contar frecuencia de cada contenido
-            conteo = df_tipo['contenido'].value_counts()
+        if tipo in TIPOS_ANALISIS_AGRUPADOS:
+            df_tipo = df_agrupado[df_agrupado['tipo_analisis'] == tipo]
+            if len(df_tipo) == 0:
+                continue
             
-            # Obtener las top 5 más frecuentes
-            top_contenidos = conteo.head(5).to_dict()
+            # Fuentes de cada contenido, de la aparición más reciente a la más antigua
+            df_tipo = df_tipo.sort_values('ultima_aparicion', ascending=False, kind='stable')
+            por_contenido = df_tipo.groupby('contenido', sort=False).agg(
+                frecuencia=('frecuencia', 'sum'),
+                fuentes=('fuente', list),
+                ultima_aparicion=('ultima_aparicion', 'max'),
+            )
+            
+            # Obtener las top 5 más frecuentes (a igual frecuencia, la más reciente primero)
+            top_contenidos = por_contenido.sort_values('frecuencia', ascending=False, kind='stable').head(5)
             
             resumen['resumen'][tipo] = {
-                'total': len(df_tipo),
+                'total': int(df_tipo['frecuencia'].sum()),
                 'top_items': [
                     {
                         'contenido': contenido,
-                        'frecuencia': freq,
-                        'fuentes': df_tipo[df_tipo['contenido'] == contenido]['fuente'].unique().tolist(),
-                        'ultima_aparicion': df_tipo[df_tipo['contenido'] == contenido]['fecha_hora'].max().strftime('%Y-%m-%d %H:%M:%S')
+                        'frecuencia': fila.frecuencia,
+                        'fuentes': fila.fuentes,
+                        'ultima_aparicion': fila.ultima_aparicion.strftime('%Y-%m-%d %H:%M:%S')
                     }
-                    for contenido, freq in top_contenidos.items()
+                    for contenido, fila in zip(top_contenidos.index, top_contenidos.itertuples())
                 ]
             }
         else:
+            df_tipo = df[df['tipo_analisis'] == tipo]
+            if len(df_tipo) == 0:
+                continue
+            
             # Para otros tipos, mostrar todos pero agrupar por fuente
             resumen['resumen'][tipo] = {
                 'total': len(df_tipo),
@@ -1523,6 +1924,58 @@ def get_resumen_mensual_analisis_ia(mes: int = None, año: int = None):
     
     return resumen
 
+def _checkpoint_wal():
+    """Vuelca el WAL al archivo principal para que una copia del .db quede completa"""
+    with get_connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _liberar_archivo_db():
+    """Cierra las conexiones y elimina WAL/SHM antes de reemplazar el archivo .db"""
+    global _WAL_SET
+    cerrar_conexiones()
+    # El archivo nuevo puede venir en modo rollback: volver a activar WAL
+    _WAL_SET = False
+    for sufijo in ("-wal", "-shm"):
+        Path(f"{DB_PATH}{sufijo}").unlink(missing_ok=True)
+
+def _backup_a_archivo(destino):
+    """Copia consistente de la base en uso con la API de backup online (incluye lo que está en el WAL)"""
+    with get_connection() as conn, closing(sqlite3.connect(destino)) as copia:
+        conn.backup(copia)
+
+
+def _restaurar_desde_archivo(origen):
+    """Reemplaza el contenido de la base en uso por el de otro archivo .db"""
+    try:
+        # La API de backup escribe en una transacción: las conexiones abiertas ven la base nueva
+        # y un archivo que no es una base SQLite falla sin tocar la actual
+        with closing(sqlite3.connect(origen)) as fuente, get_connection() as conn:
+            fuente.backup(conn)
+    except sqlite3.OperationalError:
+        # En modo WAL no se puede cambiar el tamaño de página: reemplazar el archivo
+        _liberar_archivo_db()
+        shutil.copy2(origen, DB_PATH)
+
+@_escritura
+def vacuum_db():
+    """
+    Compacta la base de datos y actualiza las estadísticas (mantenimiento manual desde Configuración).
+    Los errores se propagan para que la interfaz los muestre.
+    """
+    with get_connection() as conn:
+        if USE_POSTGRES:
+            # VACUUM no puede correr dentro de una transacción
+            conn.autocommit = True
+            try:
+                conn.cursor().execute("VACUUM ANALYZE")
+            finally:
+                conn.autocommit = False
+        else:
+            conn.execute("VACUUM")
+            conn.execute("ANALYZE")
+            conn.commit()
+
 def crear_backup_db():
     """
     Crea un backup de la base de datos.
@@ -1540,14 +1993,14 @@ def crear_backup_db():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_path = BACKUP_DIR / f"postventa_backup_{timestamp}.db"
         
-        # Copiar archivo de base de datos
-        shutil.copy2(DB_PATH, backup_path)
+        _backup_a_archivo(backup_path)
         
         return str(backup_path)
     except Exception as e:
         print(f"Error al crear backup: {e}")
         return None
 
+@_escritura
 def restaurar_backup_db(backup_path: str):
     """
     Restaura la base de datos desde un backup.
@@ -1569,10 +2022,13 @@ def restaurar_backup_db(backup_path: str):
         if DB_PATH.exists():
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             old_backup = BACKUP_DIR / f"postventa_old_{timestamp}.db"
-            shutil.copy2(DB_PATH, old_backup)
+            _backup_a_archivo(old_backup)
         
         # Restaurar desde backup
-        shutil.copy2(backup_file, DB_PATH)
+        _restaurar_desde_archivo(backup_file)
+        # Backups de versiones anteriores: aplicar las migraciones pendientes
+        init_database()
+        _datos_modificados()
         
         return True
     except Exception as e:
@@ -1619,18 +2075,21 @@ def exportar_db_a_bytes():
         return None
     
     try:
+        _checkpoint_wal()
         with open(DB_PATH, 'rb') as f:
             return f.read()
     except Exception as e:
         print(f"Error al exportar base de datos: {e}")
         return None
 
-def importar_db_desde_bytes(db_bytes: bytes):
+@_escritura
+def importar_db_desde_bytes(db_bytes):
     """
     Importa una base de datos desde bytes.
     
     Args:
-        db_bytes: Contenido de la base de datos en bytes
+        db_bytes: Contenido de la base de datos en bytes, o un archivo binario abierto
+            (p. ej. el de st.file_uploader), que se copia por bloques sin leerlo entero
     
     Returns:
         bool: True si se importó correctamente, False en caso contrario
@@ -1642,11 +2101,19 @@ def importar_db_desde_bytes(db_bytes: bytes):
         if DB_PATH.exists():
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             old_backup = BACKUP_DIR / f"postventa_old_{timestamp}.db"
-            shutil.copy2(DB_PATH, old_backup)
+            _backup_a_archivo(old_backup)
         
-        # Escribir nueva base de datos
-        with open(DB_PATH, 'wb') as f:
-            f.write(db_bytes)
+        # Escribir la base recibida en un archivo temporal y restaurarla desde ahí
+        origen = io.BytesIO(db_bytes) if isinstance(db_bytes, (bytes, bytearray)) else db_bytes
+        temporal = BACKUP_DIR / f"postventa_import_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+        try:
+            with open(temporal, 'wb') as f:
+                shutil.copyfileobj(origen, f, COPIA_BLOQUE_BYTES)
+            _restaurar_desde_archivo(temporal)
+        finally:
+            temporal.unlink(missing_ok=True)
+        init_database()
+        _datos_modificados()
         
         return True
     except Exception as e:
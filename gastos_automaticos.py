@@ -8,101 +8,102 @@ from database import get_ventas, get_gastos
 # Porcentaje de costo sobre ventas de repuestos
 COSTO_PORCENTAJE = 0.65  # 65% del valor facturado
 
+# Columnas de ventas que intervienen en el cálculo (lectura angosta)
+VENTAS_COLS_AUTOMATICOS = ("fecha", "sucursal", "tipo_re_se", "repuestos", "total")
+
+# Columnas (y su orden) de cada gasto automático generado
+GASTOS_AUTOMATICOS_COLS = [
+    'id', 'mes', 'fecha', 'sucursal', 'area', 'pct_postventa', 'pct_servicios', 'pct_repuestos',
+    'tipo', 'clasificacion', 'proveedor', 'total_usd', 'total_pct', 'total_pct_se', 'total_pct_re',
+    'automatico',
+]
+
+def _gastos_automaticos_de(costos: pd.Series, fecha_max: pd.Series, prefijo_id: str, area: str,
+                           clasificacion: str, pct_servicios: float, pct_repuestos: float,
+                           columna_costo: str, columna_cero: str) -> pd.DataFrame:
+    """Arma un gasto automático por sucursal con costo positivo"""
+    costos = costos[costos > 0]
+    fechas = fecha_max.reindex(costos.index)
+    sucursales = costos.index.to_series(index=costos.index)
+    return pd.DataFrame({
+        'id': prefijo_id + sucursales.astype(str),
+        'mes': fechas.dt.strftime("%B"),
+        'fecha': fechas,
+        'sucursal': sucursales,
+        'area': area,
+        'pct_postventa': 1.0,
+        'pct_servicios': pct_servicios,
+        'pct_repuestos': pct_repuestos,
+        'tipo': 'VARIABLE',
+        'clasificacion': clasificacion,
+        'proveedor': 'JOHN DEERE',
+        'total_usd': costos,
+        'total_pct': costos,
+        columna_costo: costos,
+        columna_cero: 0.0,
+        'automatico': True,
+    })
+
 def obtener_gastos_automaticos(fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Calcula gastos automáticos basados en las ventas registradas
     Estos gastos se generan automáticamente y no deben registrarse manualmente
     """
-    df_ventas = get_ventas(fecha_inicio, fecha_fin)
+    df_ventas = get_ventas(fecha_inicio, fecha_fin, columns=VENTAS_COLS_AUTOMATICOS)
     
     if len(df_ventas) == 0:
         return pd.DataFrame()
     
     # Asegurar que la columna fecha esté en formato datetime; coerciar inválidos
-    if 'fecha' in df_ventas.columns:
-        df_ventas['fecha'] = pd.to_datetime(df_ventas['fecha'], errors='coerce')
-        df_ventas = df_ventas.dropna(subset=['fecha'])
+    df_ventas['fecha'] = pd.to_datetime(df_ventas['fecha'], errors='coerce')
+    df_ventas = df_ventas.dropna(subset=['fecha', 'sucursal'])
+    if len(df_ventas) == 0:
+        return pd.DataFrame()
     
-    gastos_automaticos = []
+    # Una sola pasada: sumas por sucursal y tipo (RE/SE), en el orden en que aparecen las sucursales
+    # NOTA: Incluir todas las ventas (positivas y negativas/notas de crédito)
+    # Las notas de crédito reducen el costo de repuestos vendidos
+    sucursales = pd.Index(df_ventas['sucursal'].unique())
+    sumas = (
+        df_ventas.groupby(['sucursal', 'tipo_re_se'], sort=False)[['repuestos', 'total']].sum()
+        .unstack('tipo_re_se', fill_value=0.0)
+        .reindex(
+            index=sucursales,
+            columns=pd.MultiIndex.from_product([['repuestos', 'total'], ['RE', 'SE']]),
+            fill_value=0.0,
+        )
+    )
+    fecha_max = df_ventas.groupby('sucursal', sort=False)['fecha'].max()
     
-    # Agrupar por sucursal
-    sucursales = df_ventas['sucursal'].dropna().unique()
+    # 1. COSTO DE REPUESTOS VENDIDOS EN MOSTRADOR (tipo RE)
+    # IMPORTANTE: Usar la columna 'repuestos', no 'total' (como en el Excel); el total es el fallback
+    repuestos_re = sumas[('repuestos', 'RE')]
+    costo_mostrador = repuestos_re.where(repuestos_re != 0, sumas[('total', 'RE')]) * COSTO_PORCENTAJE
     
-    for sucursal in sucursales:
-        df_sucursal = df_ventas[df_ventas['sucursal'] == sucursal]
-        # NOTA: Incluir todas las ventas (positivas y negativas/notas de crédito)
-        # Las notas de crédito reducen el costo de repuestos vendidos
-        
-        # 1. COSTO DE REPUESTOS VENDIDOS EN MOSTRADOR (tipo RE)
-        # IMPORTANTE: Usar la columna 'repuestos', no 'total' (como en el Excel)
-        ventas_re = df_sucursal[df_sucursal['tipo_re_se'] == 'RE']
-        total_repuestos_mostrador = ventas_re['repuestos'].sum() if len(ventas_re) > 0 and 'repuestos' in ventas_re.columns else 0
-        # Si no hay columna repuestos o está vacía, usar el total como fallback
-        if total_repuestos_mostrador == 0:
-            total_repuestos_mostrador = ventas_re['total'].sum() if len(ventas_re) > 0 else 0
-        costo_repuestos_mostrador = total_repuestos_mostrador * COSTO_PORCENTAJE
-        
-        if costo_repuestos_mostrador > 0:
-            # Obtener fecha máxima
-            fecha_max = df_sucursal['fecha'].max() if len(df_sucursal) > 0 else None
-            mes_str = fecha_max.strftime("%B") if fecha_max is not None and pd.notna(fecha_max) else ''
-            
-            gastos_automaticos.append({
-                'id': f'AUTO_REP_{sucursal}',
-                'mes': mes_str,
-                'fecha': fecha_max,
-                'sucursal': sucursal,
-                'area': 'REPUESTOS',
-                'pct_postventa': 1.0,
-                'pct_servicios': 0.0,
-                'pct_repuestos': 1.0,
-                'tipo': 'VARIABLE',
-                'clasificacion': 'COSTO DE REPUESTOS VENDIDOS MOSTRADOR',
-                'proveedor': 'JOHN DEERE',
-                'total_usd': costo_repuestos_mostrador,
-                'total_pct': costo_repuestos_mostrador,
-                'total_pct_se': 0.0,
-                'total_pct_re': costo_repuestos_mostrador,
-                'automatico': True
-            })
-        
-        # 2. COSTO DE REPUESTOS VENDIDOS EN SERVICIOS (repuestos dentro de tipo SE)
-        ventas_se = df_sucursal[df_sucursal['tipo_re_se'] == 'SE']
-        # El costo se calcula sobre el total de repuestos vendidos en servicios
-        # Usamos la columna 'repuestos' que contiene el valor de repuestos en cada venta SE
-        total_repuestos_servicios = ventas_se['repuestos'].sum() if 'repuestos' in ventas_se.columns else 0
-        # Si no hay columna repuestos o está vacía, usar el total de la venta como aproximación
-        if total_repuestos_servicios == 0:
-            # Alternativa: calcular como porcentaje del total de ventas SE
-            # Asumiendo que en servicios, los repuestos representan una parte del total
-            total_repuestos_servicios = ventas_se['total'].sum() * 0.7  # Aproximación: 70% del total son repuestos
-        costo_repuestos_servicios = total_repuestos_servicios * COSTO_PORCENTAJE
-        
-        if costo_repuestos_servicios > 0:
-            # Obtener fecha máxima
-            fecha_max = df_sucursal['fecha'].max() if len(df_sucursal) > 0 else None
-            mes_str = fecha_max.strftime("%B") if fecha_max is not None and pd.notna(fecha_max) else ''
-            
-            gastos_automaticos.append({
-                'id': f'AUTO_SERV_{sucursal}',
-                'mes': mes_str,
-                'fecha': fecha_max,
-                'sucursal': sucursal,
-                'area': 'SERVICIO',
-                'pct_postventa': 1.0,
-                'pct_servicios': 1.0,
-                'pct_repuestos': 0.0,
-                'tipo': 'VARIABLE',
-                'clasificacion': 'COSTO DE REPUESTOS VENDIDOS EN SERVICIOS',
-                'proveedor': 'JOHN DEERE',
-                'total_usd': costo_repuestos_servicios,
-                'total_pct': costo_repuestos_servicios,
-                'total_pct_se': costo_repuestos_servicios,
-                'total_pct_re': 0.0,
-                'automatico': True
-            })
+    # 2. COSTO DE REPUESTOS VENDIDOS EN SERVICIOS (repuestos dentro de tipo SE)
+    # Sin repuestos cargados se aproxima como el 70% del total de ventas SE
+    repuestos_se = sumas[('repuestos', 'SE')]
+    costo_servicios = repuestos_se.where(repuestos_se != 0, sumas[('total', 'SE')] * 0.7) * COSTO_PORCENTAJE
+    
+    mostrador = _gastos_automaticos_de(
+        costo_mostrador, fecha_max, 'AUTO_REP_', 'REPUESTOS', 'COSTO DE REPUESTOS VENDIDOS MOSTRADOR',
+        pct_servicios=0.0, pct_repuestos=1.0, columna_costo='total_pct_re', columna_cero='total_pct_se',
+    )
+    servicios = _gastos_automaticos_de(
+        costo_servicios, fecha_max, 'AUTO_SERV_', 'SERVICIO', 'COSTO DE REPUESTOS VENDIDOS EN SERVICIOS',
+        pct_servicios=1.0, pct_repuestos=0.0, columna_costo='total_pct_se', columna_cero='total_pct_re',
+    )
+    if len(mostrador) == 0 and len(servicios) == 0:
+        return pd.DataFrame()
     
-    return pd.DataFrame(gastos_automaticos)
+    # Por sucursal: primero mostrador, después servicios
+    orden = pd.concat([
+        pd.Series(sucursales.get_indexer(mostrador.index) * 2, index=mostrador.index),
+        pd.Series(sucursales.get_indexer(servicios.index) * 2 + 1, index=servicios.index),
+    ], ignore_index=True)
+    gastos_automaticos = pd.concat([mostrador, servicios], ignore_index=True)[GASTOS_AUTOMATICOS_COLS]
+    # infer_objects: mismos dtypes que al armar el DataFrame desde una lista de dicts
+    return gastos_automaticos.iloc[orden.argsort(kind='stable')].reset_index(drop=True).infer_objects()
 
 def obtener_gastos_totales_con_automaticos(fecha_inicio: str = None, fecha_fin: str = None) -> dict:
     """
@@ -112,17 +113,12 @@ def obtener_gastos_totales_con_automaticos(fecha_inicio: str = None, fecha_fin:
     (COSTO DE REPUESTOS VENDIDOS MOSTRADOR y COSTO DE REPUESTOS VENDIDOS EN SERVICIOS)
     para evitar duplicación, ya que estos se calculan dinámicamente.
     """
-    df_gastos = get_gastos(fecha_inicio, fecha_fin)
-    
-    # Excluir gastos que se calculan automáticamente (para evitar duplicación)
+    # Excluir gastos que se calculan automáticamente (para evitar duplicación), ya en la consulta
     clasificaciones_automaticas = [
         'COSTO DE REPUESTOS VENDIDOS MOSTRADOR',
         'COSTO DE REPUESTOS VENDIDOS EN SERVICIOS'
     ]
-    
-    if len(df_gastos) > 0:
-        # Filtrar gastos que NO son automáticos
-        df_gastos = df_gastos[~df_gastos['clasificacion'].isin(clasificaciones_automaticas)]
+    df_gastos = get_gastos(fecha_inicio, fecha_fin, excluir_clasificaciones=clasificaciones_automaticas)
     
     # Calcular gastos automáticos
     df_gastos_automaticos = obtener_gastos_automaticos(fecha_inicio, fecha_fin)
@@ -139,10 +135,13 @@ def obtener_gastos_totales_con_automaticos(fecha_inicio: str = None, fecha_fin:
     else:
         df_todos = df_gastos.copy()
     
-    # Calcular totales
-    gastos_postventa_total = df_todos['total_pct_se'].sum() + df_todos['total_pct_re'].sum() if len(df_todos) > 0 else 0
-    gastos_se_total = df_todos['total_pct_se'].sum() if len(df_todos) > 0 else 0
-    gastos_re_total = df_todos['total_pct_re'].sum() if len(df_todos) > 0 else 0
+    # Calcular totales (una sola suma por columna)
+    if len(df_todos) > 0:
+        gastos_se_total = df_todos['total_pct_se'].sum()
+        gastos_re_total = df_todos['total_pct_re'].sum()
+    else:
+        gastos_se_total = gastos_re_total = 0
+    gastos_postventa_total = gastos_se_total + gastos_re_total
     
     return {
         'gastos_registrados': df_gastos,
@@ -14,8 +14,11 @@ O define las variables individuales:
 """
 from __future__ import annotations
 
+import io
 import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
 
 import psycopg2
@@ -41,17 +44,26 @@ def build_postgres_url() -> str | None:
 
 POSTGRES_URL = build_postgres_url()
 SQLITE_PATH = Path("postventa.db")
+# Filas leídas de SQLite por bloque
+CHUNK_SIZE = 5000
 
 if not POSTGRES_URL:
     raise SystemExit("Define POSTGRES_URL (o variables POSTGRES_HOST/DB/USER/PASSWORD)")
 if not SQLITE_PATH.exists():
     raise SystemExit("No se encontró postventa.db; cópialo junto al script antes de migrar.")
 
-sqlite_conn = sqlite3.connect(SQLITE_PATH)
-sqlite_conn.row_factory = sqlite3.Row
-pg_conn = psycopg2.connect(POSTGRES_URL, cursor_factory=psycopg2.extras.RealDictCursor)
-pg_conn.autocommit = False
-pg_cur = pg_conn.cursor()
+
+def open_sqlite() -> sqlite3.Connection:
+    conn = sqlite3.connect(SQLITE_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def open_postgres():
+    conn = psycopg2.connect(POSTGRES_URL, cursor_factory=psycopg2.extras.RealDictCursor)
+    conn.autocommit = False
+    return conn
+
 
 TABLES = [
     (
@@ -138,48 +150,78 @@ TABLES = [
 
 
 def migrate_table(table: str, columns: list[str]):
-    rows = sqlite_conn.execute(
-        f"SELECT {', '.join(columns)} FROM {table} ORDER BY id"
-    ).fetchall()
-    if not rows:
-        print(f"- {table}: sin datos, se omite")
-        return
-
-    placeholders = ", ".join(["%s"] * len(columns))
-    insert_sql = (
-        f"INSERT INTO {table} ({', '.join(columns)})"
-        f" VALUES ({placeholders}) ON CONFLICT (id) DO NOTHING"
-    )
+    # Cada tabla usa sus propias conexiones: se migran en paralelo desde hilos distintos
+    sqlite_conn = open_sqlite()
+    pg_conn = open_postgres()
+    try:
+        pg_cur = pg_conn.cursor()
+        # Carga única y reintentable: sin esperar el fsync del WAL en el commit, y más memoria
+        # para reconstruir índices
+        pg_cur.execute("SET LOCAL synchronous_commit TO OFF")
+        pg_cur.execute("SET LOCAL maintenance_work_mem TO '256MB'")
+        # El cursor se consume por bloques: la tabla nunca se carga entera en memoria
+        cursor = sqlite_conn.execute(
+            f"SELECT {', '.join(columns)} FROM {table} ORDER BY id"
+        )
 
-    payload = []
-    for row in rows:
-        values = []
-        for col in columns:
-            val = row[col]
-            if col == "activa" and val is not None:
-                values.append(bool(val))
-            else:
-                values.append(val)
-        payload.append(tuple(values))
+        # COPY a una tabla temporal (sin parsear un INSERT por fila) y de ahí un único
+        # INSERT ... SELECT que conserva el ON CONFLICT (id) DO NOTHING
+        staging = f"_migracion_{table}"
+        pg_cur.execute(
+            f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        copy_sql = f"COPY {staging} ({', '.join(columns)}) FROM STDIN"
 
-    psycopg2.extras.execute_batch(pg_cur, insert_sql, payload, page_size=500)
-    _reset_sequence(table)
-    pg_conn.commit()
-    print(f"- {table}: insertados {len(rows)} registros")
+        migrados = 0
+        while True:
+            rows = list(islice(cursor, CHUNK_SIZE))
+            if not rows:
+                break
 
+            buffer = io.StringIO()
+            for row in rows:
+                values = []
+                for col in columns:
+                    val = row[col]
+                    if col == "activa" and val is not None:
+                        values.append(_copy_value(bool(val)))
+                    else:
+                        values.append(_copy_value(val))
+                buffer.write("\t".join(values))
+                buffer.write("\n")
+            buffer.seek(0)
 
-def _reset_sequence(table: str):
-    pg_cur.execute(
-        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
-        f"COALESCE((SELECT MAX(id) FROM {table}), 1), true)"
-    )
+            pg_cur.copy_expert(copy_sql, buffer)
+            migrados += len(rows)
 
+        if not migrados:
+            print(f"- {table}: sin datos, se omite")
+            return
 
-def main():
-    try:
-        for table, cols in TABLES:
-            migrate_table(table, cols)
-    except Exception as exc:
+        # Índices secundarios: más barato reconstruirlos una vez que actualizarlos fila a fila.
+        # Los únicos se mantienen (respaldan restricciones y el ON CONFLICT)
+        pg_cur.execute(
+            "SELECT indexname, indexdef FROM pg_indexes"
+            " WHERE schemaname = current_schema() AND tablename = %s"
+            " AND indexdef NOT LIKE 'CREATE UNIQUE INDEX%%'",
+            (table,),
+        )
+        indices = pg_cur.fetchall()
+        for indice in indices:
+            pg_cur.execute(f"DROP INDEX {indice['indexname']}")
+
+        pg_cur.execute(
+            f"INSERT INTO {table} ({', '.join(columns)})"
+            f" SELECT {', '.join(columns)} FROM {staging} ON CONFLICT (id) DO NOTHING"
+        )
+
+        for indice in indices:
+            pg_cur.execute(indice["indexdef"])
+
+        _reset_sequence(pg_cur, table)
+        pg_conn.commit()
+        print(f"- {table}: insertados {migrados} registros")
+    except Exception:
         pg_conn.rollback()
         raise
     finally:
@@ -187,5 +229,33 @@ def main():
         pg_conn.close()
 
 
+def _copy_value(val) -> str:
+    """Valor en el formato de texto de COPY: NULL como \\N y separadores escapados"""
+    if val is None:
+        return "\\N"
+    return (
+        str(val)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _reset_sequence(pg_cur, table: str):
+    pg_cur.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM {table}), 1), true)"
+    )
+
+
+def main():
+    # Las tablas son independientes (sin claves foráneas): una por hilo, limitado por la red
+    with ThreadPoolExecutor(max_workers=len(TABLES)) as pool:
+        futures = [pool.submit(migrate_table, table, cols) for table, cols in TABLES]
+        for future in futures:
+            future.result()
+
+
 if __name__ == "__main__":
     main()